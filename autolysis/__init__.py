@@ -12,7 +12,7 @@ import pandas as pd
 from io import open
 from scipy.stats.mstats import ttest_ind
 from scipy.stats import chi2_contingency
-from .meta import metadata
+from .meta import metadata, iter_metadata, get_engine
 __folder__ = os.path.split(os.path.abspath(__file__))[0]
 
 # Load autolysis.__version__ from release.json
@@ -21,6 +21,29 @@ with open(os.path.join(__folder__, 'release.json'), encoding='utf-8') as _releas
     __version__ = release['version']
 
 
+def connect(url, table=None):
+    '''
+    Returns blaze data for a SQLAlchemy database ``url``. This reuses the
+    engine (and its connection pool) that :func:`autolysis.meta.metadata` uses.
+
+    Parameters
+    ----------
+    url : str
+        SQLAlchemy URL, e.g. ``sqlite:///data.db``
+    table : str
+        Optional table name. If specified, returns the blaze data for the table
+
+    Examples
+    --------
+    Usage::
+
+        data = connect('sqlite:///data.db', 'sales')
+        types(data)
+    '''
+    data = bz.Data(get_engine(url))
+    return data[table] if table is not None else data
+
+
 def is_date(series):
     '''
     Returns ``True`` if the first 1000 non-null values in a ``series`` are
@@ -398,4 +421,6 @@ __all__ = [
     'groupmeans',
     'crosstabs',
     'metadata',
+    'iter_metadata',
+    'connect',
 ]
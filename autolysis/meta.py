@@ -5,80 +5,428 @@ Generates standardised metadata for tabular datasets. Typical usage::
     info = Metadata('tests/data/x.csv')
     info = Metadata('file:///tests/data/x.csv')
 '''
-from __future__ import unicode_literals
+from __future__ import unicode_literals, division
 
 import io
 import os
+import bz2
+import csv
+import gzip
+import atexit
+import re
 import json
 import time
+import mmap
+import datetime
+import random
+import struct
+import tarfile
+import zipfile
 import shutil
 import logging
 import requests
+import threading
 import subprocess
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from tqdm import tqdm
 from hashlib import md5
-from six import text_type
-from functools import wraps
+from six import text_type, string_types, integer_types
+from six.moves import cPickle as pickle, range
+from six.moves.collections_abc import MutableMapping
+from functools import wraps, partial
 from itertools import islice, chain
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from orderedattrdict import AttrDict
 
 from six.moves.urllib_parse import urlparse
 from .config import DATA_DIR
+from .sketch import ColumnSketch, is_numeric
 
 OK = 200                    # HTTP status code
+PARTIAL_CONTENT = 206       # HTTP status code
+NOT_MODIFIED = 304          # HTTP status code
+RANGE_NOT_SATISFIABLE = 416     # HTTP status code
 seconds_per_day = 86400     # Number of seconds in a day
+_engines, _inspectors, _schemas = {}, {}, {}    # Shared SQLAlchemy objects, keyed by URL
+_engine_lock = threading.RLock()
+_session, _session_lock = None, threading.Lock()     # Shared requests Session
+_workbooks, _workbook_lock = {}, threading.Lock()    # Shared Excel workbooks, keyed by path
+_stores, _store_lock = {}, threading.Lock()          # Shared HDF5 stores, keyed by path
+fetch_threads = 4           # Number of concurrent downloads in fetch_all
+scan_chunksize = 100000     # Number of rows per chunk when scanning full datasets
+preview_rows = 10000        # Number of rows to profile in a preview
+preview_bytes = 2 ** 25     # Maximum number of bytes (32MB) to read for a preview
+hash_bytes = 2 ** 26        # Hash files up to 64MB fully. Sample blocks from larger files
+sniff_bytes = 2 ** 16       # Number of bytes to read to guess a file's format
+encoding_bytes = 2 ** 22    # Number of bytes (4MB) to read to detect a file's encoding
+remote_bytes = 2 ** 20      # Number of bytes (1MB) of remote files to detect encoding, count rows
+default_encodings = ('utf-8', 'cp1252')     # Encodings that detect_encoding checks in order
+member_sep = '::'           # Separates an archive's path from its member's name
+_compact_keys = {'head', 'sample'}      # Meta keys whose DataFrames are stored pickled
+
+
+def metadata(source, tables=None, root=None, merge=True, full=False, cache=False, dedup=False,
+             schema_sample=None, download=True, lazy=False, **kwargs):
+    '''
+    Return the metadata for the selected source as a Meta.
+
+    By default, each dataset is profiled from a preview of its first rows. Set
+    ``full=True`` to stream every row through mergeable sketches instead. This
+    takes longer, but ``rows``, ``missing`` and ``moments`` are exact and
+    ``nunique`` and ``top`` are accurate estimates for the whole dataset.
+
+    Set ``cache=True`` to re-use profiles from earlier calls for datasets that
+    have not changed (cached under ``root/cache``), or pass a ``MetaCache``.
+
+    Set ``dedup=True`` to profile datasets with identical contents only once.
+    Copies get the same profile and a ``duplicate`` key with the path (list of
+    dataset names) of the first copy. Files over ``hash_bytes`` bytes are
+    compared by a hash of sampled blocks, not the full contents.
+
+    Set ``catalog=True`` to estimate SQL table profiles from the database's
+    statistics (see ``catalog_sql``) without reading tables. This is almost
+    instant. Tables without statistics are profiled as usual.
+
+    Set ``pushdown=True`` to profile SQL tables in the database with aggregate
+    queries (see ``profile_sql``) instead of fetching a preview.
+
+    Set ``sample=True`` to preview a random sample of SQL tables' rows (see
+    ``sample_sql``) instead of their first rows. This is slower, but is more
+    representative for tables ordered by time or key. ``nrows`` sets the size.
+    ``rows`` is the table's row count (see ``count_sql``) and ``sample_rows``
+    the number of rows sampled.
+
+    Set ``download=False`` to profile HTTP sources without downloading them,
+    if the server supports Range requests. Previews read just the leading
+    bytes they need, and CSV and JSON Lines ``rows`` are estimated from the
+    size. ``Meta.data()`` reads the whole file.
+
+    Set ``schema_sample=n`` to profile only ``n`` datasets among siblings with
+    identical headers, e.g. daily partitions in a directory. The rest only get
+    their ``rows`` counted, and ``columns`` refers to a profiled dataset, like
+    ``merge`` does.
+
+    Set ``lazy=True`` to return the tree without profiling any dataset. A
+    dataset is profiled when a key it lacks is first accessed, e.g.
+    ``tree.datasets['Sheet1'].rows``. (``.get()`` and ``in`` do not profile.)
+    ``tree.materialize(jobs=n)`` profiles all datasets using ``n`` threads
+    and merges column metadata. ``dedup`` and ``schema_sample`` are ignored.
+    '''
+    root = metadata_root(root)
+    tree = source_tree(source, tables, root, download)
+    if cache is True:
+        cache = MetaCache(os.path.join(root, 'cache'))
+    if lazy:
+        for path, node in walk(tree):
+            if node.get('command', [None])[0] is not None:
+                node._lazy = partial(profile_cached, cache=cache, full=full, **kwargs)
+    else:
+        for path, node in profile_tree(tree, full, cache, dedup, schema_sample, **kwargs):
+            pass
+        if merge:
+            merge_columns(tree)
+    return tree
 
 
-def metadata(source, tables=None, root=None, merge=True, **kwargs):
+def iter_metadata(source, tables=None, root=None, full=False, cache=False, dedup=False,
+                  schema_sample=None, download=True, **kwargs):
     '''
-    Return the metadata for the selected source as a Meta.
+    Yield (path, node) for each dataset in source as soon as it is found and
+    profiled. path is a tuple of dataset names. node is a Meta like the
+    datasets that ``metadata()`` returns, and the parameters are the same.
+    But ``metadata()`` waits for all datasets and keeps all their profiles in
+    memory. This does neither. Column metadata is not merged. For example::
+
+        with io.open('meta.jsonl', 'w', encoding='utf-8') as handle:
+            to_jsonl(iter_metadata('folder/'), handle)
+
+    With ``dedup=True``, duplicates only have the ``duplicate`` path, since
+    the profile was yielded with the first copy. With ``schema_sample``, all
+    datasets are found before the first is profiled.
     '''
+    root = metadata_root(root)
+    if cache is True:
+        cache = MetaCache(os.path.join(root, 'cache'))
+    nodes = iter_source(source, tables, root, download)
+    path, tree = next(nodes)
+    return profile_tree(tree, full, cache, dedup, schema_sample, keep=False,
+                        nodes=chain([(path, tree)], nodes), **kwargs)
+
+
+def metadata_root(root=None):
+    '''Return the folder that saves downloads, extracts and caches. Create it if required'''
     if root is None:
         root = os.path.join(DATA_DIR, '.metadata')
     if not os.path.exists(root):
         os.makedirs(root)
+    return root
+
+
+def source_tree(source, tables=None, root=None, download=True):
+    '''
+    Return the tree of datasets in source, with the command to read each
+    dataset, but without profiling them. See ``metadata()`` for parameters.
+    '''
+    nodes = iter_source(source, tables, root, download)
+    path, tree = next(nodes)
+    for path, node in nodes:
+        pass
+    return tree
 
-    # Extract base metadata along with commands to extract the data
+
+def iter_source(source, tables=None, root=None, download=True):
+    '''
+    Yield (path, node) for source and each dataset in it as soon as it is
+    found, like ``walk()``. The first node is the tree, which grows as
+    datasets are found. See ``source_tree()``.
+    '''
+    root = metadata_root(root)
+    # Reflect the schema afresh, in case tables changed since the last call
+    forget_reflection()
     tree = Meta(source=source)
     scheme = urlparse(source).scheme
     if os.path.exists(source) or scheme in {'file'}:
-        tree.update(metadata_file(source, root, tables))
+        nodes = iter_file(source, root, tables, tree)
+    elif scheme in {'http', 'https'} and not download and accepts_ranges(source):
+        nodes = iter_file(source, root, tables, tree)
     elif scheme in {'http', 'https', 'ftp'}:
         target = filename(source, root)
         fetch(source, target)
-        tree.update(metadata_file(target, root, tables))
+        nodes = iter_file(target, root, tables, tree)
     else:
         tree.format = 'sql'
         tree.update(metadata_sql(source, tables))
+        nodes = walk(tree)
+    for path, node in nodes:
+        node._root = root
+        yield path, node
 
-    # Extract sub-datasets
-    dataset_list = list(datasets(tree))
-    for node in tqdm(dataset_list, disable=kwargs.get('tqdm_disable')):
-        cmd = node.get('command', [None])
-        if cmd[0] in _preview_command:
-            try:
-                data = _preview_command[cmd[0]](*cmd[1:])
-                node.update(metadata_frame(data, **kwargs))
-            except Exception as e:
-                node['error'] = str(e)
-                logging.exception('Unable to load %s', ':'.join(cmd[1:]))
-
-    # Merge column metadata of common datasets
-    if merge:
-        for node in datasets(tree):
-            if 'datasets' in node:
-                sign_lookup = {}
-                for data in node.datasets.values():
-                    if 'columns' in data:
-                        sign = tuple(col.name for col in data.columns.values())
-                        if sign in sign_lookup:
-                            data.columns = AttrDict(see=sign_lookup[sign].name)
-                        else:
-                            sign_lookup[sign] = data
 
-    return tree
+def profile_tree(tree, full=False, cache=None, dedup=False, schema_sample=None, keep=True,
+                 nodes=None, **kwargs):
+    '''
+    Profile each dataset in tree, re-using profiles in cache (a MetaCache)
+    if the source is unchanged. Yield (path, node) for each dataset profiled.
+    If ``keep`` is False, yield a copy of the node and remove its profile from
+    the tree, so that memory does not grow with the number of datasets.
+    ``nodes`` iterates over (path, node) in tree, e.g. from ``iter_source()``,
+    and defaults to ``walk(tree)``.
+    '''
+    nodes = list(walk(tree)) if nodes is None else nodes
+    if schema_sample is not None:
+        # Schema groups need all siblings. So find all datasets first
+        nodes = list(nodes)
+        skip = schema_groups(tree, schema_sample)
+    else:
+        skip = {}
+    # seen maps each dataset hash to the path of its first copy
+    seen, hashes = {}, {}
+    try:
+        for path, node in tqdm(nodes, disable=kwargs.get('tqdm_disable')):
+            cmd = node.get('command', [None])
+            keys = set(node.keys())
+            if id(node) in skip:
+                node.rows = _count_command[cmd[0]](*cmd[1:])
+                node.columns = AttrDict(see=skip[id(node)].name)
+            else:
+                digest = None
+                if dedup:
+                    digest = dataset_hash(cmd, hashes, kwargs.get('hash_bytes', hash_bytes))
+                if digest in seen:
+                    # Copy the profile of the first copy, unless keep=False removed it
+                    for key, value in list(get_node(tree, seen[digest]).items()):
+                        if key not in node:
+                            node[key] = value
+                    node.duplicate = list(seen[digest])
+                else:
+                    profile_cached(node, cache=cache, full=full, **kwargs)
+                    if digest is not None:
+                        seen[digest] = path
+            if cmd[0] is None:
+                continue
+            if not keep:
+                node, profiled = Meta(node), node
+                for key in set(profiled.keys()) - keys:
+                    del profiled[key]
+            yield path, node
+    finally:
+        if cache:
+            cache.evict()
+        # Evict extracts only after profiling, since datasets may be read from them
+        root = metadata_root(tree._root)
+        for name, cache_class in (('extract', ExtractCache), ('frames', FrameCache)):
+            if os.path.exists(os.path.join(root, name)):
+                cache_class(os.path.join(root, name)).evict()
+        close_workbooks()
+        close_stores()
+
+
+def merge_columns(tree):
+    '''
+    Merge column metadata of common datasets. If sibling datasets have the
+    same column names, the later datasets' ``columns`` refer to the first.
+    '''
+    for node in datasets(tree):
+        if 'datasets' in node:
+            sign_lookup = {}
+            for data in node.datasets.values():
+                # Skip datasets whose columns already refer to another dataset
+                if isinstance(data.get('columns'), Columns):
+                    sign = tuple(col.name for col in data.columns.values())
+                    if sign in sign_lookup:
+                        data.columns = AttrDict(see=sign_lookup[sign].name)
+                    else:
+                        sign_lookup[sign] = data
+
+
+def to_jsonl(items, handle, **kwargs):
+    '''
+    Write (path, node) items, e.g. from ``iter_metadata()``, to a text file
+    handle as JSON Lines. Each line is the node with a ``path`` key: the list
+    of dataset names. kwargs are passed to ``json.dumps``. Returns the number
+    of lines written.
+    '''
+    kwargs.setdefault('cls', PandasEncoder)
+    lines = 0
+    for path, node in items:
+        record = Meta(path=list(path))
+        record.update(node)
+        handle.write(text_type(json.dumps(record, **kwargs)) + '\n')
+        lines += 1
+    return lines
+
+
+def profile_cached(node, cache=None, **kwargs):
+    '''
+    Profile a dataset node like ``profile(node, **kwargs)``. If cache (a
+    ``MetaCache``) has the node's profile, use that. Else save the profile in
+    the cache. Returns the profile.
+    '''
+    key = cache.key(node, **kwargs) if cache else None
+    result = cache.get(key) if key else None
+    if result is not None:
+        node.update(result)
+    else:
+        keys = set(node.keys())
+        profile(node, **kwargs)
+        result = Meta((k, v) for k, v in node.items() if k not in keys)
+        if key and 'error' not in result:
+            cache.put(key, result)
+    return result
+
+
+def _load(nodes):
+    '''Profile lazy dataset nodes in sequence'''
+    for node in nodes:
+        load, node._lazy = node._lazy, None
+        if load is not None:
+            load(node)
+
+
+def _load_group(node):
+    '''Lazy datasets in the same group are profiled in sequence by Meta.materialize()'''
+    cmd = node.get('command', [None])
+    if cmd[0] == 'hdf5':
+        return cmd[0]           # PyTables is not thread-safe
+    elif cmd[0] == 'xlsx':
+        return cmd[1]           # Sheets in a workbook share a handle
+    return id(node)
+
+
+def profile(node, full=False, pushdown=False, catalog=False, sample=False, nrows=preview_rows,
+            nbytes=preview_bytes, **kwargs):
+    '''
+    Update a dataset node with its profile (rows, columns, head, sample) using
+    the node's command, and return it. Errors are saved in its ``error`` key.
+
+    By default, profile a preview of the first ``nrows`` rows, reading at most
+    ``nbytes`` bytes of text formats. ``rows`` counts the whole dataset where
+    that is cheap. CSV files count lines without parsing. Excel sheets and
+    HDF5 nodes read it from their metadata. Parquet and Feather files read it
+    from their footer, as well as ``missing``, ``min`` and ``max`` for Parquet.
+    Remote CSV and JSON Lines files estimate it from their size.
+
+    - ``catalog=True`` estimates SQL table profiles from database statistics
+    - ``pushdown=True`` computes SQL table profiles in the database
+    - ``full=True`` scans the entire dataset in chunks
+    - ``sample=True`` previews a random sample of SQL tables (see ``sample_sql``)
+    '''
+    cmd = node.get('command', [None])
+    try:
+        if catalog and cmd[0] in _catalog_command:
+            estimate = _catalog_command[cmd[0]](*cmd[1:], nrows=nrows, **kwargs)
+            if estimate is not None:
+                node.update(estimate)
+                return node
+        if pushdown and cmd[0] in _pushdown_command:
+            node.update(_pushdown_command[cmd[0]](*cmd[1:], **kwargs))
+        elif full and cmd[0] in _scan_command:
+            node.update(metadata_chunks(_scan_command[cmd[0]](*cmd[1:]), **kwargs))
+        elif cmd[0] in _preview_command:
+            sampled = sample and cmd[0] in _sample_command
+            method = _sample_command if sampled else _preview_command
+            data = method[cmd[0]](*cmd[1:], nrows=nrows, nbytes=nbytes)
+            node.update(metadata_frame(data, **kwargs))
+            if sampled:
+                # rows counts the whole dataset, not just the sample
+                node.sample_rows = len(data)
+                node.update(_sample_rows_command[cmd[0]](*cmd[1:]))
+            if cmd[0] in _footer_command:
+                update_footer(node, _footer_command[cmd[0]](*cmd[1:]))
+        if cmd[0] in _estimate_command and is_url(cmd[1]):
+            node.size = file_size(cmd[1])
+            # If the preview may be truncated, estimate the rows from the size
+            if not full and (len(data) >= nrows or node.size > nbytes):
+                node.rows = _estimate_command[cmd[0]](*cmd[1:])
+                node.estimated = ['rows']
+        elif cmd[0] in _count_command:
+            size = file_size(cmd[1])
+            if size is not None:
+                node.size = size
+            # If the preview may be truncated, count the rows without parsing
+            if not full and (len(data) >= nrows or size is None or size > nbytes):
+                node.rows = _count_command[cmd[0]](*cmd[1:])
+        elif cmd[0] in _rows_command and not full and len(data) >= nrows:
+            # The preview may be truncated. Get the rows from the file's metadata
+            rows = _rows_command[cmd[0]](*cmd[1:])
+            if rows is not None:
+                node.rows = rows
+    except Exception as e:
+        node['error'] = str(e)
+        logging.exception('Unable to load %s', ':'.join(text_type(part) for part in cmd[1:]))
+    return node
+
+
+def schema_groups(tree, sample):
+    '''
+    Group sibling datasets in tree that have identical headers. Return a dict
+    mapping the id() of datasets beyond the first ``sample`` in each group to
+    the first dataset in the group. The profiled sample is evenly spaced.
+    '''
+    skip, sample = {}, max(sample, 1)
+    for node in datasets(tree):
+        groups = OrderedDict()
+        for data in node.get('datasets', Datasets()).values():
+            cmd = data.get('command', [None])
+            if cmd[0] in _schema_command:
+                try:
+                    sign = (cmd[0], ) + _schema_command[cmd[0]](*cmd[1:])
+                except Exception:
+                    logging.exception('Unable to read header of %s',
+                                      ':'.join(text_type(part) for part in cmd[1:]))
+                    continue
+                groups.setdefault(sign, []).append(data)
+        for group in groups.values():
+            if len(group) <= sample:
+                continue
+            profiled = set(len(group) * index // sample for index in range(sample))
+            for index, data in enumerate(group):
+                if index not in profiled:
+                    skip[id(data)] = group[0]
+    return skip
 
 
 def metadata_sql(source, tables=None):
@@ -86,11 +434,10 @@ def metadata_sql(source, tables=None):
     Returns metadata for a SQLAlchemy source URL for a subset of tables
     '''
     try:
-        engine = sa.create_engine(source)       # noqa: encoding kills Py2.7
+        inspector = get_inspector(source)
     except sa.exc.ArgumentError:
         raise NotImplementedError('Cannot process source %s' % source)
     if tables is None:
-        inspector = sa.inspect(engine)
         tables = inspector.get_table_names()
     tree = Meta(datasets=Datasets())
     for table in tables:
@@ -102,50 +449,256 @@ def metadata_sql(source, tables=None):
     return tree
 
 
+def profile_sql(table, source, top=3, preview=10, **kwargs):
+    '''
+    Compute the metadata for a SQL table in the database, without fetching
+    rows. One aggregate query computes the row count, and for each column the
+    missing and distinct counts (exact ``COUNT(DISTINCT)``), and for numeric
+    columns the count, mean, std, min and max. One query per column fetches
+    the ``top`` values. ``head`` has the first ``preview`` rows.
+    '''
+    engine = get_engine(source)
+    table = get_table(source, table)
+    stddev = _stddev.get(engine.dialect.name)
+    aggs = [sa.func.count().label('rows')]
+    for col in table.columns:
+        aggs += [sa.func.count(col), sa.func.count(sa.distinct(col))]
+        if _is_numeric_sql(col.type):
+            value = sa.cast(col, sa.Float)
+            aggs += [sa.func.min(col), sa.func.max(col), sa.func.avg(value)]
+            # Without a standard deviation function, get the sum of squares
+            aggs.append(getattr(sa.func, stddev)(value) if stddev else
+                        sa.func.sum(value * value))
+    with engine.connect() as conn:
+        stats = list(conn.execute(sa.select(aggs)).fetchone())
+        rows = stats.pop(0)
+        columns = Columns()
+        for col in table.columns:
+            meta = Column(name=text_type(col.name))
+            count, meta.nunique = stats.pop(0), stats.pop(0)
+            meta.missing = rows - count
+            meta.type_pandas = _pandas_type(col.type, meta.missing)
+            query = (sa.select([col, sa.func.count()]).where(col.isnot(None))
+                     .group_by(col).order_by(sa.func.count().desc()).limit(top))
+            values = conn.execute(query).fetchall()
+            meta.top = pd.Series([row[1] for row in values], name=col.name,
+                                 index=[row[0] for row in values])
+            if _is_numeric_sql(col.type):
+                low, high, mean, std = [stats.pop(0) for stat in range(4)]
+                if not stddev:
+                    # std is the sum of squares. Convert to a sample standard deviation
+                    variance = (std - count * mean * mean) / (count - 1) if count > 1 else 0
+                    std = max(variance, 0) ** 0.5 if count > 1 else None
+                meta.moments = pd.Series(
+                    [count, mean, std, low, high],
+                    index=['count', 'mean', 'std', 'min', 'max'], name=col.name, dtype=float)
+            columns[meta.name] = meta
+        head = pd.read_sql(sa.select([table]).limit(preview), conn)
+    return Meta([('rows', rows), ('columns', columns), ('head', head)])
+
+
+def catalog_sql(table, source, top=3, nrows=preview_rows, **kwargs):
+    '''
+    Estimate the metadata for a SQL table from the database's planner
+    statistics, without reading the table. Supports PostgreSQL (``pg_class``,
+    ``pg_stats``) and SQLite (``sqlite_stat1``, after ``ANALYZE``). Returns
+    None if the table has no statistics.
+
+    ``estimated`` lists the estimated keys in the table and in each column.
+    Column statistics the catalog lacks (all but indexed columns' ``nunique``
+    in SQLite) are estimated from a random sample of ``nrows`` rows (see
+    ``sample_sql``). ``top`` only has values that repeat in the sample.
+    '''
+    engine, inspector = get_engine(source), get_inspector(source)
+    method = _catalog_stats.get(engine.dialect.name)
+    with engine.connect() as conn:
+        catalog = method(conn, table, inspector) if method else None
+    if catalog is None:
+        return None
+    rows, stats = catalog
+    columns, data = Columns(), None
+    for col in inspector.get_columns(table):
+        meta = Column(name=text_type(col['name']))
+        stat = stats.get(col['name'], {})
+        if any(key not in stat for key in ('missing', 'nunique', 'top')):
+            if data is None:
+                data = sample_sql(table, source, nrows=nrows, **kwargs)
+                scale = rows / len(data) if len(data) else 0
+            series = data[col['name']]
+            counts = series.value_counts()
+            stat = dict(stat)
+            stat.setdefault('missing', int(round(series.isnull().sum() * scale)))
+            stat.setdefault('nunique', _estimate_nunique(counts, rows - stat['missing']))
+            # Values seen once in the sample may be unique. Only scale repeated values
+            stat.setdefault('top', counts[counts > 1] * scale)
+        meta.type_pandas = _pandas_type(col['type'], stat['missing'])
+        meta.missing = stat['missing']
+        meta.nunique = stat['nunique']
+        meta.top = stat['top'].head(top).round().astype(int).rename(col['name'])
+        meta.estimated = ['missing', 'nunique', 'top']
+        columns[meta.name] = meta
+    return Meta([('rows', rows), ('columns', columns), ('estimated', ['rows'])])
+
+
+def _estimate_nunique(counts, total):
+    '''
+    Estimate the distinct values among total values from the value counts of
+    a sample, using Haas and Stokes' Duj1 estimator, like PostgreSQL's ANALYZE
+    '''
+    sampled, distinct, once = counts.sum(), len(counts), (counts == 1).sum()
+    if sampled == 0 or sampled >= total:
+        return int(distinct)
+    estimate = sampled * distinct / (sampled - once + once * sampled / total)
+    return int(round(min(max(estimate, distinct), total)))
+
+
+def _catalog_postgresql(conn, table, inspector):
+    '''Return (rows, {column: stats}) from PostgreSQL planner statistics, or None'''
+    rows = conn.execute(sa.text(
+        'SELECT c.reltuples FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE c.relname = :table AND n.nspname = current_schema()'
+    ).bindparams(table=table)).scalar()
+    # reltuples is -1 (PostgreSQL 14+) or 0 for tables that were never analyzed
+    if not rows or rows < 0:
+        return None
+    rows, stats = int(rows), {}
+    query = sa.text(
+        'SELECT attname, null_frac, n_distinct, most_common_vals::text::text[], '
+        'most_common_freqs FROM pg_stats '
+        'WHERE tablename = :table AND schemaname = current_schema()'
+    ).bindparams(table=table)
+    for name, null_frac, n_distinct, values, freqs in conn.execute(query):
+        # Negative n_distinct is the negative of the fraction of rows that are distinct
+        stats[name] = {
+            'missing': int(round(null_frac * rows)),
+            'nunique': int(round(n_distinct if n_distinct >= 0 else -n_distinct * rows)),
+        }
+        # Most common values are returned as text, since pg_stats does not preserve types.
+        # Columns without them (e.g. unique columns) have no frequent values
+        stats[name]['top'] = pd.Series([freq * rows for freq in freqs or []],
+                                       index=values or [], dtype=float)
+    return rows, stats
+
+
+def _catalog_sqlite(conn, table, inspector):
+    '''Return (rows, {column: stats}) from SQLite's sqlite_stat1 table, or None'''
+    if conn.execute(sa.text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar():
+        result = conn.execute(sa.text('SELECT idx, stat FROM sqlite_stat1 WHERE tbl = :table')
+                              .bindparams(table=table)).fetchall()
+    else:
+        result = []
+    if not result:
+        return None
+    # The stat column has the number of rows, then the average number of rows
+    # per distinct value of the first 1, 2, ... indexed columns
+    indexes = {index['name']: index['column_names'] for index in inspector.get_indexes(table)}
+    rows, stats = None, {}
+    for index, stat in result:
+        numbers = [int(value) for value in stat.split() if value.isdigit()]
+        rows = numbers[0]
+        if index in indexes and len(numbers) > 1 and numbers[1]:
+            column = indexes[index][0]
+            stats.setdefault(column, {})['nunique'] = int(round(float(rows) / numbers[1]))
+    return rows, stats
+
+
+def _is_numeric_sql(type):
+    return isinstance(type, (sa.Integer, sa.Numeric)) and not isinstance(type, sa.Boolean)
+
+
+def _pandas_type(type, missing):
+    '''Return the Pandas dtype name that read_sql_table uses for a SQLAlchemy type'''
+    if isinstance(type, sa.Boolean):
+        return 'object' if missing else 'bool'
+    if isinstance(type, sa.Integer):
+        return 'float64' if missing else 'int64'
+    if isinstance(type, sa.Numeric):
+        return 'float64'
+    if isinstance(type, (sa.DateTime, sa.Date)):
+        return 'datetime64[ns]'
+    return 'object'
+
+
 def metadata_file(path, root, tables=None):
     '''
     Returns the metadata for a file. There are 3 types of file formats:
 
     1. Archives (7z, zip, rar, tar) / compressed (xz, bzip2, gzip). Decompress and process
     2. Database (sqlite3, hdf5, xls, xlsx). Process each table/sheet as a sub-dataset
-    3. Data (csv, json). Process directly
+    3. Data (csv, json, jsonl, parquet, feather). Process directly
+
+    Members of zip, tar, xz, bzip2 and gzip archives are read directly from
+    the archive. Their path is ``archive::member`` (see ``open_file``).
+    7z and rar archives, and sqlite3 and hdf5 files inside archives, are
+    extracted into an ``ExtractCache`` at ``root/extract``.
+
+    The command for CSV files has a dict of options for ``read_csv`` as its
+    last element, e.g. ``['csv', path, {'encoding': 'cp1252', 'sep': ';'}]``.
     '''
     tree = Meta()
+    for names, node in iter_file(path, root, tables, tree):
+        pass
+    return tree
+
+
+def iter_file(path, root, tables=None, tree=None, names=()):
+    '''
+    Like ``metadata_file()``, but add the metadata to tree (a Meta) in place.
+    Yield (names, node) for tree and each dataset in it as soon as it is found,
+    like ``walk()``. names is the tuple of dataset names from tree to node.
+    '''
+    tree = Meta() if tree is None else tree
     format = guess_format(path)
+    # .json files may have JSON Lines
+    if format == 'json' and sniff(path).format == 'jsonl':
+        format = 'jsonl'
     if format is not None:
         tree.format = format
+    # These formats can only be read from a file on disk
+    if format in {'7z', 'rar', 'sqlite3', 'hdf5'}:
+        if is_url(path):
+            path = fetch(path, filename(path, root))
+        elif is_member(path):
+            path = extract_member(path, root)
 
     if format == 'dir':
         tree.datasets = Datasets()
+        yield names, tree
         for base, dirs, files in os.walk(path):
-            for filename in files:
-                source = os.path.join(base, filename)
+            for each in files:
+                source = os.path.join(base, each)
                 name = os.path.relpath(source, path)
                 tree.datasets[name] = submeta = Meta(name=name, source=source)
                 try:
-                    submeta.update(metadata_file(source, root, tables))
+                    for item in iter_file(source, root, tables, submeta, names + (name, )):
+                        yield item
                 except Exception as e:
                     submeta['error'] = str(e)
                     logging.exception('Unable to get metadata for %s', source)
+        return
     elif format in {'7z', 'zip', 'rar', 'tar', 'xz', 'gz', 'bz2'}:
         tree.datasets = Datasets()
-        for name, source in unzip_files(path, root, format):
+        yield names, tree
+        if format in _archive_open:
+            members = archive_members(path, format)
+        else:
+            members = unzip_files(path, root, format)
+        for name, source in members:
             tree.datasets[name] = submeta = Meta(name=name)
             try:
-                submeta.update(metadata_file(source, root, tables))
+                for item in iter_file(source, root, tables, submeta, names + (name, )):
+                    yield item
             except Exception as e:
                 submeta['error'] = str(e)
                 logging.exception('Unable to get metadata for %s', source)
+        return
     elif format == 'sqlite3':
         tree.update(metadata_sql('sqlite:///' + path, tables))
     elif format in {'hdf5', 'xls', 'xlsx'}:
         if format == 'hdf5':
-            store = pd.HDFStore(path)
-            table_list = store.keys()
-            store.close()
+            table_list = get_store(path).keys()
         else:
-            xls = pd.ExcelFile(path)
-            table_list = xls.sheet_names
+            table_list = get_workbook(path).sheet_names
             format = 'xlsx'
         tree.datasets = Datasets()
         for table in table_list:
@@ -156,10 +709,17 @@ def metadata_file(path, root, tables=None):
                     ('command', [format, path, table])
                 ])
     elif format == 'csv':
-        tree.command = ['csv', path]
-    elif format == 'json':
-        tree.command = ['json', path]
-    return tree
+        # Save the encoding, and the delimiter if it's not a comma, as read_csv options
+        options = {'encoding': detect_encoding(
+            path, nbytes=remote_bytes if is_url(path) else encoding_bytes)}
+        dialect = sniff(path)
+        if dialect.format == 'csv' and dialect.delimiter != ',':
+            options['sep'] = dialect.delimiter
+        tree.command = ['csv', path, options]
+    elif format in {'json', 'jsonl', 'parquet', 'feather'}:
+        tree.command = [format, path]
+    for item in walk(tree, names):
+        yield item
 
 
 def metadata_frame(data, top=3, preview=10, **kwargs):
@@ -184,6 +744,51 @@ def metadata_frame(data, top=3, preview=10, **kwargs):
     return result
 
 
+def metadata_chunks(chunks, top=3, preview=10, capacity=100, **kwargs):
+    '''
+    Compute the metadata for an iterable of Pandas DataFrame chunks in constant
+    memory. Unlike ``metadata_frame``, this is computed over all chunks:
+
+    - ``rows`` and ``missing`` are exact
+    - ``nunique`` is exact up to 1,024 distinct values, and estimated (HyperLogLog) beyond that
+    - ``top`` is estimated by tracking ``capacity`` counters (space-saving)
+    - ``moments`` has an exact count, mean, std, min and max, but no quantiles
+    - ``head`` is the first ``preview`` rows. ``sample`` is a uniform random sample
+    '''
+    sketches, rows, head, sample = OrderedDict(), 0, None, None
+    for chunk in chunks:
+        # Chunks from SQL restart their index at 0. Number rows across chunks
+        if isinstance(chunk.index, pd.RangeIndex):
+            chunk.index = pd.RangeIndex(rows, rows + len(chunk))
+        rows += len(chunk)
+        for col, series in chunk.iteritems():
+            if col not in sketches:
+                sketches[col] = ColumnSketch(capacity=capacity)
+            sketches[col].update(series)
+        # Sample by keeping the rows that have the smallest random keys
+        keys = pd.Series(np.random.random(len(chunk)), index=chunk.index)
+        if head is None:
+            head, sample = chunk.head(preview), chunk.iloc[:0].assign(_key=keys[:0])
+        sample = pd.concat([sample, chunk.assign(_key=keys).nsmallest(preview, '_key')])
+        sample = sample.nsmallest(preview, '_key')
+
+    columns = Columns()
+    for col, sketch in sketches.items():
+        meta = Column(name=text_type(col))
+        meta.type_pandas = sketch.dtype.name
+        meta.missing = sketch.missing
+        meta.nunique = sketch.nunique.count()
+        meta.top = sketch.top.result(top).rename(col)
+        if is_numeric(sketch.dtype):
+            meta.moments = sketch.moments.result(name=col)
+        columns[meta.name] = meta
+    result = Meta([('rows', rows), ('columns', columns)])
+    if head is not None:
+        result['head'] = head
+        result['sample'] = sample.drop('_key', axis=1).sort_index()
+    return result
+
+
 def datasets(tree):
     yield tree
     for node in tree.get('datasets', Datasets()).values():
@@ -191,45 +796,303 @@ def datasets(tree):
             yield subnode
 
 
+def get_node(tree, path):
+    '''Return the node at path in tree. path is a tuple of dataset names, like walk() yields'''
+    for name in path:
+        tree = tree.datasets[name]
+    return tree
+
+
+def walk(tree, path=()):
+    '''Yield (path, node) for every node in tree. path is a tuple of dataset names'''
+    yield path, tree
+    for name, node in tree.get('datasets', Datasets()).items():
+        for subpath, subnode in walk(node, path + (name, )):
+            yield subpath, subnode
+
+
 def unzip_files(path, root, format):
     '''
-    Extract all files in the archive at path into root using format specified.
-    Yield (name, path) tuples for each file in the archive.
+    Extract all files in the archive at path using format specified into an
+    ``ExtractCache`` under root. Yield (name, path) tuples for each file in the
+    archive.
 
     For multi-file archives like 7z, ZIP, RAR, TAR, the name is the relative
     path to the archived file name. For single file archives like gz, bzip2,
     xz, the name is the extracted filename.
 
-    In all cases, the path is the full path to the extracted file.
-    '''
-    if format in {'7z', 'zip', 'rar', 'tar'}:
-        target = filename(path, root)
-        # If the target is outdated, delete it.
-        # Note: for ZIP inside ZIP, the first extraction creates a new file.
-        # So the inner ZIP will ALWAYS be extracted. TODO: resolve this.
-        if os.path.exists(target) and os.stat(target).st_mtime < os.stat(path).st_mtime:
-            shutil.rmtree(target)
-        # If the target does not exist, create it
-        if not os.path.exists(target):
-            os.makedirs(target)
-            extract_archive(path, target=target, format=format)
-        # Return each file
-        for base, dirs, files in os.walk(target):
-            for path in files:
-                # path is relative to archive base
-                name = os.path.join(os.path.relpath(base, target), path)
-                yield os.path.normpath(name), os.path.join(base, path)
-    elif format in {'xz', 'gz', 'bz2'}:
-        # Strip out the extension from the filename. That's the new name of the dataset
-        name = os.path.split(path)[-1]
-        if name.endswith(format):
-            name = name[:-len(format) - 1]
-        target = os.path.join(root, name)
-        # TODO: if target is fresh, do not re-extract
-        if os.path.exists(target):
-            os.unlink(target)
-        extract_archive(path, target=root, format=format)
-        yield name, target
+    In all cases, the path is the full path to the extracted file. Use
+    ``archive_members`` to read zip, tar, gz, bzip2 and xz without extracting.
+    '''
+    cache = ExtractCache(os.path.join(root, 'extract'))
+    target = cache.get(path, lambda source, temp: extract_archive(source, temp, format), '.d')
+    for base, dirs, files in os.walk(target):
+        for path in files:
+            # path is relative to archive base
+            name = os.path.join(os.path.relpath(base, target), path)
+            yield os.path.normpath(name), os.path.join(base, path)
+
+
+def archive_members(path, format):
+    '''
+    Yield (name, path) tuples for each file in a zip, tar, gz, bzip2 or xz
+    archive at path without extracting it. zip and tar members are listed from
+    the archive. Single file archives have one member: the filename without
+    the extension. The path of a member is ``archive::member``.
+    '''
+    if format in _archive_list:
+        with open_file(path) as handle:
+            names = _archive_list[format](handle)
+    else:
+        name = os.path.split(path.split(member_sep)[-1])[-1]
+        names = [name[:-len(format) - 1] if name.endswith('.' + format) else name]
+    for name in names:
+        yield os.path.normpath(name), path + member_sep + name
+
+
+def is_member(path):
+    '''True if path is an archive member, e.g. ``data.zip::sales.csv``'''
+    return isinstance(path, string_types) and member_sep in path
+
+
+def open_file(path):
+    '''
+    Return a binary file handle to read path. For archive members, e.g.
+    ``data.zip::2019/sales.csv``, the member is decompressed as it is read.
+    Members can be nested, e.g. ``data.tar.gz::data.tar::sales.csv``.
+    HTTP URLs are read via Range requests (see ``HTTPFile``).
+    '''
+    if not is_member(path):
+        return _open_local_or_url(path)
+    parts = path.split(member_sep)
+    handles, size = [_open_local_or_url(parts[0])], None
+    try:
+        for index in range(1, len(parts)):
+            format = guess_format(member_sep.join(parts[:index]))
+            if format not in _archive_open:
+                raise ValueError('Cannot read %s from %s archive' % (path, format))
+            opened, size = _archive_open[format](handles[-1], parts[index])
+            handles.extend(opened)
+    except Exception:
+        for handle in reversed(handles):
+            handle.close()
+        raise
+    return ArchiveMember(handles, size)
+
+
+def is_url(path):
+    '''True if path is an HTTP or HTTPS URL'''
+    return isinstance(path, string_types) and urlparse(path).scheme in {'http', 'https'}
+
+
+def _open_local_or_url(path):
+    if is_url(path):
+        return io.BufferedReader(HTTPFile(path), buffer_size=2 ** 16)
+    return io.open(path, 'rb')
+
+
+def accepts_ranges(url, timeout=60):
+    '''
+    True if the server for url responds to HTTP Range requests and reports the
+    file size. Otherwise, the file must be read in full, e.g. via ``fetch()``.
+    '''
+    with get_session().get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                           timeout=timeout) as r:
+        return r.status_code == PARTIAL_CONTENT and _range_size(r) is not None
+
+
+def _range_size(r):
+    '''Return the file size from a response's "Content-Range: bytes start-end/size", or None'''
+    total = r.headers.get('Content-Range', '').rpartition('/')[-1]
+    return int(total) if total.isdigit() else None
+
+
+def file_size(path):
+    '''Return the size of the file or URL at path in bytes. For compressed members, return None'''
+    if is_url(path):
+        return HTTPFile(path).size
+    if not is_member(path):
+        return os.stat(path).st_size
+    with open_file(path) as handle:
+        return handle.size
+
+
+def extract_member(path, root):
+    '''
+    Extract an archive member into an ``ExtractCache`` under root, unless a
+    member with the same contents was extracted. Return the extracted file.
+    '''
+    return ExtractCache(os.path.join(root, 'extract')).get(path, _copy_member)
+
+
+def _copy_member(path, target):
+    with open_file(path) as handle, io.open(target, 'wb') as out:
+        shutil.copyfileobj(handle, out)
+
+
+def read_member(method):
+    '''
+    Wrap Pandas read_* methods whose first argument is a path so that they can
+    also read archive members. If a chunksize is passed, the member is closed
+    after the last chunk is read.
+    '''
+    @wraps(method)
+    def wrapped(path, *args, **kwargs):
+        if not is_member(path):
+            return method(path, *args, **kwargs)
+        handle = open_file(path)
+        try:
+            result = method(handle, *args, **kwargs)
+        except Exception:
+            handle.close()
+            raise
+        if kwargs.get('chunksize') is not None:
+            return _closing(result, handle)
+        handle.close()
+        return result
+    return wrapped
+
+
+def _closing(chunks, handle):
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        handle.close()
+
+
+class ArchiveMember(io.BufferedIOBase):
+    '''
+    A binary file handle to an archive member. handles are the file and
+    archive objects opened to read it, ending with the member's handle. They
+    are closed when it is closed. size is the member's size, if known.
+    '''
+    def __init__(self, handles, size=None):
+        self.handles, self.handle, self.size = handles, handles[-1], size
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.handle.read(-1 if size is None else size)
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readline(self, size=-1):
+        return self.handle.readline(size)
+
+    def readinto(self, buffer):
+        data = self.handle.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seekable(self):
+        return self.handle.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.handle.seek(offset, whence)
+
+    def tell(self):
+        return self.handle.tell()
+
+    def close(self):
+        if not self.closed:
+            for handle in reversed(self.handles):
+                handle.close()
+        super(ArchiveMember, self).close()
+
+
+class HTTPFile(io.RawIOBase):
+    '''
+    A read-only, seekable binary file handle to an HTTP url. Each read fetches
+    just the bytes required with a Range request. Wrap it in an
+    ``io.BufferedReader`` to avoid a request for every small read. Requests
+    time out after ``timeout`` seconds.
+    '''
+    def __init__(self, url, timeout=60):
+        self.url, self.pos, self._size, self.timeout = url, 0, None, timeout
+
+    @property
+    def size(self):
+        if self._size is None:
+            r = get_session().head(self.url, allow_redirects=True, timeout=self.timeout)
+            r.raise_for_status()
+            length = r.headers.get('Content-Length', '')
+            if length.isdigit():
+                self._size = int(length)
+            else:
+                # Servers may omit Content-Length, e.g. for compressed responses
+                with get_session().get(self.url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                       timeout=self.timeout) as r:
+                    self._size = _range_size(r)
+                if self._size is None:
+                    raise IOError('%s does not report its size' % self.url)
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readinto(self, buffer):
+        if len(buffer) == 0 or (self._size is not None and self.pos >= self._size):
+            return 0
+        headers = {'Range': 'bytes=%d-%d' % (self.pos, self.pos + len(buffer) - 1)}
+        r = get_session().get(self.url, headers=headers, timeout=self.timeout)
+        if r.status_code == RANGE_NOT_SATISFIABLE:
+            return 0
+        r.raise_for_status()
+        if r.status_code != PARTIAL_CONTENT:
+            raise IOError('%s does not support HTTP Range requests' % self.url)
+        size = _range_size(r)
+        if size is not None:
+            self._size = size
+        data = r.content[:len(buffer)]
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+def _list_zip(handle):
+    with zipfile.ZipFile(handle) as archive:
+        return [info.filename for info in archive.infolist() if not info.filename.endswith('/')]
+
+
+def _list_tar(handle):
+    with tarfile.open(fileobj=handle, mode='r:*') as archive:
+        # Older 7-zip versions wrote a PaxHeaders folder. Ignore that
+        return [info.name for info in archive if info.isfile() and not any(
+            part.lower().startswith('paxheaders.') for part in info.name.split('/'))]
+
+
+def _open_zip(handle, name):
+    archive = zipfile.ZipFile(handle)
+    info = archive.getinfo(name)
+    return [archive, archive.open(info)], info.file_size
+
+
+def _open_tar(handle, name):
+    archive = tarfile.open(fileobj=handle, mode='r:*')
+    info = archive.getmember(name)
+    return [archive, archive.extractfile(info)], info.size
+
+
+def _open_xz(handle, name):
+    import lzma         # Not available in Python 2.7
+    return [lzma.LZMAFile(handle)], None
 
 
 def extract_archive(archive, target, format):
@@ -265,19 +1128,197 @@ def filename(url, root, path=None):
     return os.path.abspath(os.path.join(root, filename))
 
 
-def fetch(url, path, expiry_days=1):
+def get_engine(url):
+    '''
+    Return a SQLAlchemy engine for url. Engines are shared across the process,
+    so connections are pooled. Call ``dispose_engines()`` to close them.
+    '''
+    with _engine_lock:
+        if url not in _engines:
+            _engines[url] = sa.create_engine(url)       # noqa: encoding kills Py2.7
+        return _engines[url]
+
+
+def get_inspector(url):
+    '''
+    Return a shared SQLAlchemy inspector for url. It caches reflected table
+    information until ``forget_reflection()``, which each ``metadata()`` call runs.
+    '''
+    engine = get_engine(url)
+    with _engine_lock:
+        if url not in _inspectors:
+            _inspectors[url] = sa.inspect(engine)
+        return _inspectors[url]
+
+
+def get_table(url, name):
+    '''Return a SQLAlchemy Table reflected from the table name at url, cached like get_inspector'''
+    engine = get_engine(url)
+    with _engine_lock:
+        metadata = _schemas.setdefault(url, sa.MetaData())
+        if name not in metadata.tables:
+            sa.Table(name, metadata, autoload=True, autoload_with=engine)
+        return metadata.tables[name]
+
+
+def forget_reflection(url=None):
+    '''
+    Forget cached inspectors and tables for url, or for all URLs if url is
+    None. Engines (and their pooled connections) are kept.
+    '''
+    with _engine_lock:
+        for key in list(_inspectors) + list(_schemas) if url is None else [url]:
+            _inspectors.pop(key, None)
+            _schemas.pop(key, None)
+
+
+def dispose_engines(url=None):
+    '''
+    Close pooled connections and forget cached reflection for url, or for all
+    engines if url is None. Called automatically when Python exits.
+    '''
+    with _engine_lock:
+        for key in list(_engines) if url is None else [url]:
+            engine = _engines.pop(key, None)
+            if engine is not None:
+                engine.dispose()
+        forget_reflection(url)
+
+
+atexit.register(dispose_engines)
+
+
+def command_path(cmd):
     '''
-    Retrieves the HTTP or FTP url and saves it into path, unless path is newer than expiry_days.
-    Returns the path
+    Return the local file or archive member that a command reads from, or
+    None if the command does not read a local file (e.g. a SQL server).
     '''
-    now = time.time()
-    if os.path.exists(path) and os.stat(path.st_mtime) > now - expiry_days * seconds_per_day:
+    if cmd[0] == 'sql':
+        url = sa.engine.url.make_url(cmd[2])
+        path = url.database if url.drivername.startswith('sqlite') else None
+    else:
+        path = cmd[1]
+    if path and os.path.isfile(path.split(member_sep)[0]):
         return path
-    r = requests.get(url)
-    if r.status_code == OK and len(r.content):
-        with io.open(path, 'wb') as handle:
-            handle.write(r.content)
-    # TODO: in case of ANY failure, raise an exception
+
+
+def source_stamp(cmd):
+    '''Return [path, size, mtime] of the local file that a command reads from, or None'''
+    path = command_path(cmd)
+    if path is not None:
+        # Archive members are stamped with their archive's size and mtime
+        archive = path.split(member_sep)[0]
+        stat = os.stat(archive)
+        return [os.path.abspath(archive) + path[len(archive):], stat.st_size, stat.st_mtime]
+
+
+def content_hash(path, hash_bytes=hash_bytes, block=2 ** 16):
+    '''
+    Return the MD5 hash of the file at path. If the file is larger than
+    hash_bytes, hash its size and 64 evenly spaced blocks of ``block`` bytes
+    (including the first and last block) instead. This is much faster for
+    large files, but may miss changes that lie entirely between the blocks.
+    Archive members are always hashed fully.
+    '''
+    digest = md5()
+    size = None if is_member(path) else os.stat(path).st_size
+    with open_file(path) as handle:
+        if hash_bytes is None or size is None or size <= hash_bytes:
+            for data in iter(lambda: handle.read(block), b''):
+                digest.update(data)
+        else:
+            digest.update(text_type(size).encode('utf-8'))
+            samples = 64
+            for index in range(samples):
+                handle.seek(max(size - block, 0) * index // (samples - 1))
+                digest.update(handle.read(block))
+    return digest.hexdigest()
+
+
+def dataset_hash(cmd, memo, hash_bytes=hash_bytes):
+    '''
+    Return a hash of the dataset a command reads, or None if it does not read
+    a local file. It depends on the file contents and table, not the file
+    path. memo is a dict that caches file hashes by path, size and mtime.
+    '''
+    stamp = source_stamp(cmd) if cmd[0] is not None else None
+    if stamp is None:
+        return None
+    key = tuple(stamp)
+    if key not in memo:
+        memo[key] = content_hash(stamp[0], hash_bytes)
+    table = cmd[1:2] if cmd[0] == 'sql' else cmd[2:]
+    return json.dumps([cmd[0], table, memo[key]])
+
+
+def get_session():
+    '''
+    Return a requests Session shared across the process. It pools up to
+    ``fetch_threads`` connections per host, and re-uses them across fetches.
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=fetch_threads)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def fetch(url, path, expiry_days=1, chunk_size=2 ** 20, timeout=60):
+    '''
+    Retrieves the HTTP url and saves it into path, unless path is newer than expiry_days.
+    Returns the path.
+
+    The response is streamed into a temporary file in chunks of chunk_size
+    bytes, and renamed to path when complete. Its ETag and Last-Modified
+    headers are saved in ``path + '.headers'``. If path is older than
+    expiry_days, the url is fetched only if it has changed since. Raises
+    ``requests.HTTPError`` if the server returns an error.
+    '''
+    if os.path.exists(path) and os.stat(path).st_mtime > (
+            time.time() - expiry_days * seconds_per_day):
+        return path
+    headers, saved = {}, path + '.headers'
+    if os.path.exists(path) and os.path.exists(saved):
+        with io.open(saved, encoding='utf-8') as handle:
+            validators = json.load(handle)
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+    with get_session().get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == NOT_MODIFIED:
+            # Restart the expiry period
+            os.utime(path, None)
+            return path
+        r.raise_for_status()
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with io.open(temp, 'wb') as handle:
+                for chunk in r.iter_content(chunk_size):
+                    handle.write(chunk)
+            _replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+        validators = {key: r.headers[key] for key in ('ETag', 'Last-Modified') if key in r.headers}
+    with io.open(saved, 'w', encoding='utf-8') as handle:
+        handle.write(text_type(json.dumps(validators)))
+    return path
+
+
+def fetch_all(targets, threads=fetch_threads, **kwargs):
+    '''
+    Fetch a list of (url, path) tuples with up to ``threads`` concurrent
+    downloads. Returns the list of paths. kwargs are passed to ``fetch``.
+    '''
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(lambda target: fetch(target[0], target[1], **kwargs), targets)
+    finally:
+        pool.close()
 
 
 def guess_format(path, ignore_ext=False):
@@ -285,7 +1326,8 @@ def guess_format(path, ignore_ext=False):
     Returns file format for data files based on the file extension or signature.
     File signatures / magic are from http://www.garykessler.net/library/file_sigs.html
     '''
-    base, ext = os.path.splitext(path)
+    name = path.split(member_sep)[-1]
+    base, ext = os.path.splitext(urlparse(name).path if is_url(name) else name)
     ext = ext.lower()
     if ext and not ignore_ext:
         ext = ext[1:]
@@ -294,67 +1336,222 @@ def guess_format(path, ignore_ext=False):
     # Guess based on signature
     if os.path.isdir(path):     # Directories are allowed, and have a 'dir' format
         return 'dir'
-    signature_length = 20       # It's enough to read ~20 bytes to identify the file
-    with io.open(path, 'rb') as handle:
-        head = handle.read(signature_length)
-    if head.startswith(b'7z\xbc\xaf\x27\x1c'):
-        return '7z'
-    if head.startswith(b'PK') and head[2:4] in {b'\x03\x04', b'\x05\x06', b'\x07\x08'}:
-        from zipfile import ZipFile
-        for filename in ZipFile(path).namelist():
-            if filename.startswith('xl/'):
-                return 'xlsx'
-        return 'zip'
-    if head.startswith(b'Rar!\x1A\x07\x00'):
-        return 'rar'
-    if head.startswith(b'ustar') or head.startswith(b'./PaxHeaders'):
-        return 'tar'
-    if head.startswith(b'\xfd7zXZ\x00'):
-        return 'xz'
-    if head.startswith(b'\x1f\x8b'):
-        return 'gz'
-    if head.startswith(b'BZh'):
-        return 'bz2'
-    if head.startswith(b'SQLite format 3\x00'):
-        return 'sqlite3'
-    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
-        return 'xls'
-    if head.startswith(b'\x89\x48\x44\x46\x0d\x0a\x1a\x0a'):
-        return 'hdf5'
+    return sniff(path).format
+
+
+def sniff(path, nbytes=sniff_bytes):
+    '''
+    Returns an AttrDict with the ``format`` of a file (None if unknown), reading
+    at most nbytes from its start. ZIP files also read their central directory
+    (up to nbytes) to distinguish xlsx from zip. CSV files also return the
+    ``delimiter``, and ``header`` (True if the first row looks like a header).
+    '''
+    result = AttrDict(format=None)
+    with open_file(path) as handle:
+        head = handle.read(nbytes)
+        complete = len(handle.read(1)) == 0
+        for magic, format in _magic:
+            if head.startswith(magic):
+                result.format = format
+                return result
+        if head.startswith(b'PK') and head[2:4] in {b'\x03\x04', b'\x05\x06', b'\x07\x08'}:
+            result.format = 'xlsx' if _zip_has(handle, b'xl/workbook', nbytes) else 'zip'
+            return result
+    # Tar files have "ustar" at offset 257. Older 7-zip versions wrote a PaxHeaders folder
+    if head[257:262] == b'ustar' or head.startswith(b'./PaxHeaders'):
+        result.format = 'tar'
+        return result
+
+    # Text formats. Ignore the last line if the file is truncated
+    text = _decode_sample(head)
+    lines = text.splitlines()
+    if not complete:
+        lines = lines[:-1]
+    if text.lstrip()[:1] in {'[', '{'}:
+        if complete and _is_json(text):
+            result.format = 'json'
+        elif _is_json_lines(lines):
+            result.format = 'jsonl'
+        elif not complete:
+            # A JSON document larger than nbytes. Assume it's valid
+            result.format = 'json'
+        if result.format is not None:
+            return result
+    dialect = sniff_csv(lines)
+    if dialect is not None:
+        result.update(format='csv', **dialect)
+    return result
+
+
+def sniff_csv(lines, delimiters=',\t;|', sample=100):
+    '''
+    Returns an AttrDict with the CSV ``delimiter`` and ``header`` (True if the
+    first row looks like a header) from a list of lines of text. Returns None
+    unless there are at least 2 columns and 1 row of data after the header.
+    '''
+    lines = lines[:sample]
+    best, fields = None, 1
+    for delimiter in delimiters:
+        try:
+            counts = [len(row) for row in csv.reader(lines, delimiter=str(delimiter)) if row]
+        except csv.Error:
+            continue
+        # Most rows should have as many columns as the header
+        if len(counts) >= 2 and counts[0] > fields and counts.count(counts[0]) > len(counts) / 2:
+            best, fields = delimiter, counts[0]
+    if best is None:
+        return None
     try:
-        read_json(path)
-        return 'json'
-    except (ValueError, pd.core.common.PandasError):
-        pass
+        header = csv.Sniffer().has_header('\n'.join(lines))
+    except csv.Error:
+        header = True
+    return AttrDict(delimiter=best, header=header)
+
+
+def _decode_sample(data):
+    '''Decode a sample of bytes from the start of a file that may be truncated'''
+    return data.decode(_guess_encoding(data) or 'latin-1', 'replace')
+
+
+def _is_json(text):
     try:
-        # Since almost any file matches CSV, ensure it has at least 1 row, 2 cols
-        result = next(read_csv_encoded(path, chunksize=1000))
-        if len(result) >= 1 and len(result.columns) >= 2:
-            return 'csv'
-    except Exception:
-        pass
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_json_lines(lines):
+    '''True if every non-empty line is a JSON object or array, and there is at least one'''
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return False
+    try:
+        return all(isinstance(json.loads(line), (dict, list)) for line in lines)
+    except ValueError:
+        return False
+
+
+def _zip_has(handle, name, nbytes):
+    '''
+    True if any file in the ZIP file handle starts with name. Reads only the
+    end of central directory record and up to nbytes of the central directory.
+    '''
+    handle.seek(0, os.SEEK_END)
+    size = handle.tell()
+    # The end of central directory record is 22 bytes plus a comment of up to 64KB
+    handle.seek(max(0, size - 22 - 65535))
+    tail = handle.read()
+    pos = tail.rfind(b'PK\x05\x06')
+    if pos < 0 or len(tail) < pos + 22:
+        return False
+    cd_size, cd_offset = struct.unpack(str('<II'), tail[pos + 12:pos + 20])
+    if cd_offset == 0xFFFFFFFF:
+        # ZIP64 archives store the offset elsewhere. Fall back to the zipfile module
+        handle.seek(0)
+        return any(filename.startswith(name.decode('utf-8'))
+                   for filename in zipfile.ZipFile(handle).namelist())
+    handle.seek(cd_offset)
+    directory = handle.read(min(cd_size, nbytes))
+    # Each central directory entry has a 46 byte header followed by the filename
+    return directory.find(b'PK\x01\x02') >= 0 and name in directory
 
 
 def read_csv_encoded(*args, **kwargs):
     '''
-    Read a CSV file via Pandas ``read_csv`` with different encodings. By default,
-    try CP-1252 and then UTF-8. Set ``encodings=('encoding', ...)`` to change the
-    list of encodings to try.
+    Read a CSV file via Pandas ``read_csv``. Unless an ``encoding=`` is given,
+    detect it once from a sample via ``detect_encoding``. Set
+    ``encodings=('encoding', ...)`` to change the list of encodings to check.
+    '''
+    encodings = kwargs.pop('encodings', default_encodings)
+    if kwargs.get('encoding') is None:
+        kwargs['encoding'] = detect_encoding(args[0], encodings=encodings)
+    return pd.read_csv(*args, **kwargs)
+
+
+def detect_encoding(source, nbytes=encoding_bytes, encodings=default_encodings):
+    '''
+    Return the encoding of a file path or binary file handle from its first
+    nbytes. Check for a byte order mark, then for UTF-16 without one (many NUL
+    bytes at alternate positions), then return the first of ``encodings`` that
+    decodes the sample. Raises CSVEncodingError if none do.
+
+    If the sample is ASCII but the file is longer, any encoding may follow. So
+    scan the rest of the file for its first non-ASCII byte and guess from the
+    bytes there. (HTTP URLs are not scanned, since that downloads the file.)
     '''
-    for encoding in kwargs.pop('encodings', ('cp1252', 'utf-8', 'utf-16-le', 'utf-16-be')):
+    if hasattr(source, 'read'):
+        pos = source.tell()
         try:
-            kwargs['encoding'] = encoding
-            result = pd.read_csv(*args, **kwargs)
-            if 'chunksize' in kwargs:
-                peek = next(result)
-                return chain([peek], result)
-            else:
-                return result
-        except Exception:
-            pass
-    raise CSVEncodingError()
+            encoding = _detect_encoding(source, nbytes, encodings, scan=True)
+        finally:
+            source.seek(pos)
+    else:
+        with open_file(source) as handle:
+            encoding = _detect_encoding(handle, nbytes, encodings, scan=not is_url(source))
+    if encoding is None:
+        raise CSVEncodingError('%s is not encoded in any of %s' % (source, ', '.join(encodings)))
+    return encoding
+
+
+def _detect_encoding(handle, nbytes, encodings, scan):
+    data = handle.read(nbytes)
+    encoding = _guess_encoding(data, encodings)
+    if (scan and len(data) == nbytes and encoding is not None and
+            not encoding.startswith('utf-16') and _is_ascii(data)):
+        sample = _non_ascii_sample(handle)
+        if sample:
+            encoding = _guess_encoding(sample, encodings)
+    return encoding
 
 
+def _non_ascii_sample(handle, size=sniff_bytes, block=2 ** 22):
+    '''
+    Read handle until its first non-ASCII byte and return up to size bytes from
+    there. Return an empty bytes object if the rest of the file is ASCII.
+    '''
+    for data in iter(lambda: handle.read(block), b''):
+        high = np.frombuffer(data, dtype=np.uint8) > 0x7F
+        if high.any():
+            data = data[int(high.argmax()):]
+            while len(data) < size:
+                more = handle.read(size - len(data))
+                if not more:
+                    break
+                data += more
+            return data[:size]
+    return b''
+
+
+def _is_ascii(data):
+    '''True if a bytes object has only ASCII characters'''
+    try:
+        data.decode('ascii')
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _guess_encoding(data, encodings=default_encodings):
+    '''Return the encoding of a sample of bytes from the start of a file that may be truncated'''
+    for bom, encoding in _bom:
+        if data.startswith(bom):
+            return encoding
+    nuls = data[:2 ** 16].count(b'\x00')
+    if nuls > len(data[:2 ** 16]) / 8:
+        even, odd = data[0:2 ** 16:2].count(b'\x00'), data[1:2 ** 16:2].count(b'\x00')
+        return 'utf-16-le' if odd > even else 'utf-16-be'
+    for encoding in encodings:
+        try:
+            data.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            # A multi-byte character may be truncated at the end of the sample
+            if e.reason == 'unexpected end of data' and e.start >= len(data) - 3:
+                return encoding
+
+
+@read_member
 def read_json(*args, **kwargs):
     '''
     Read a CSV file via Pandas ``read_json``. If the JSON has only 1 row, return
@@ -369,10 +1566,12 @@ def read_json(*args, **kwargs):
         raise
 
 
-class MetaDict(AttrDict):
+class MetaBase(object):
     '''
-    Base class for all metadata structures
+    Methods common to all metadata structures
     '''
+    __slots__ = ()
+
     def _repr_pretty_(self, p, cycle):
         '''Printing the object in IPython prints str(object)'''
         lines = str(self).split('\n')
@@ -381,26 +1580,65 @@ class MetaDict(AttrDict):
             p.break_()
         p.text(lines[-1])
 
-    def to_json(self, **kwargs):
-        import json
+    def to_json(self, handle=None, **kwargs):
+        '''Return the metadata as a JSON string, or write it to the file handle'''
         kwargs.setdefault('cls', PandasEncoder)
         kwargs.setdefault('indent', 4)
-        return json.dumps(self, **kwargs)
+        if handle is None:
+            return json.dumps(self, **kwargs)
+        json.dump(self, handle, **kwargs)
 
-    def to_yaml(self, **kwargs):
+    def to_yaml(self, handle=None, **kwargs):
+        '''Return the metadata as a YAML string, or write it to the file handle'''
         import yaml
         import orderedattrdict.yamlutils            # noqa. Imported to preserve order in YAML
         kwargs.setdefault('default_flow_style', False)
-        data = json.loads(self.to_json(indent=0), object_pairs_hook=AttrDict)
-        return yaml.dump(data, **kwargs)
+        return yaml.dump(to_primitives(self), handle, **kwargs)
+
+
+class MetaDict(MetaBase, AttrDict):
+    '''
+    Base class for all metadata structures except Column
+    '''
 
 
 class Meta(MetaDict):
+    '''
+    Metadata for a source or dataset. ``head`` and ``sample`` DataFrames are
+    stored pickled, which takes far less memory, and unpickled on access.
+    '''
+    __exclude_keys__ = {'_lazy', '_root'}
+    _lazy = None            # Function that profiles this dataset. See metadata(lazy=True)
+    _root = None            # Folder for downloads, extracts and caches. See metadata_root()
+
+    def __getitem__(self, key):
+        value = super(Meta, self).__getitem__(key)
+        return value.frame() if isinstance(value, _CompactFrame) else value
+
+    def __setitem__(self, key, value):
+        if key in _compact_keys and isinstance(value, pd.DataFrame):
+            value = _CompactFrame(value)
+        super(Meta, self).__setitem__(key, value)
+
+    def get(self, key, default=None):
+        value = super(Meta, self).get(key, default)
+        return value.frame() if isinstance(value, _CompactFrame) else value
+
+    def __missing__(self, key):
+        # Profile lazy datasets when a key they lack is first accessed. Skip
+        # private keys, which IPython and others probe for
+        if self._lazy is not None and not text_type(key).startswith('_'):
+            _load([self])
+            return self[key]
+        raise KeyError(key)
+
     def __str__(self, rows=100):
         name = self.get('name', self.get('source', ''))
         format = self.get('format', 'format?')
         result = []
-        if 'datasets' in self:
+        if self._lazy is not None:
+            result.append('{:s} ({:s}). Not profiled yet'.format(name, format))
+        elif 'datasets' in self:
             result.append('{:s} ({:s}) {:d} datasets'.format(
                 name, format, len(self.datasets)))
             if rows:
@@ -415,10 +1653,53 @@ class Meta(MetaDict):
                 name, format))
         return '\n'.join(result)
 
-    def data(self):
+    def data(self, cache=None, **kwargs):
+        '''
+        Return the dataset as a DataFrame. kwargs are passed to the read method,
+        e.g. ``columns=[...]`` reads only some columns of parquet and feather files.
+
+        Set ``cache=True`` to save the data in a columnar format under the
+        ``frames`` folder of the metadata ``root`` (or pass a ``FrameCache``).
+        Later calls load it from there without parsing, until the source file
+        changes.
+        '''
         cmd = self.get('command', [None])
-        if cmd[0] in _read_command:
-            return _read_command[cmd[0]](*cmd[1:])
+        if cmd[0] not in _read_command:
+            return None
+        if cache is True:
+            cache = FrameCache(os.path.join(metadata_root(self._root), 'frames'))
+        key = cache.key(cmd, **kwargs) if cache else None
+        result = cache.get(key) if key else None
+        if result is None:
+            result = _read_command[cmd[0]](*cmd[1:], **kwargs)
+            if key:
+                cache.put(key, result)
+        return result
+
+    def materialize(self, jobs=1, merge=True):
+        '''
+        Profile all lazy datasets in the tree (see ``metadata(lazy=True)``)
+        using up to ``jobs`` threads. If ``merge`` is True, merge column
+        metadata of common datasets. Returns the tree.
+        '''
+        groups = OrderedDict()
+        for node in datasets(self):
+            if node._lazy is not None:
+                groups.setdefault(_load_group(node), []).append(node)
+        if jobs > 1 and len(groups) > 1:
+            pool = ThreadPool(min(jobs, len(groups)))
+            try:
+                pool.map(_load, list(groups.values()))
+            finally:
+                pool.close()
+        else:
+            for nodes in groups.values():
+                _load(nodes)
+        close_workbooks()
+        close_stores()
+        if merge:
+            merge_columns(self)
+        return self
 
     def to_excel(self):
         pass
@@ -447,7 +1728,89 @@ class Columns(MetaDict):
         return '\n'.join(result)
 
 
-class Column(MetaDict):
+class Column(MetaBase, MutableMapping):
+    '''
+    Metadata for a column. Works like an AttrDict, e.g. ``col.top`` or
+    ``col['top']``, but stores the usual keys in ``__slots__``. ``top`` and
+    ``moments`` are stored as arrays, and returned as a new Series on access.
+    So to change them, assign a changed copy, e.g. ``col.top = col.top * 2``.
+    '''
+    _fields = ('name', 'type_pandas', 'missing', 'nunique', 'top', 'moments')
+    __slots__ = ('_name', '_type_pandas', '_missing', '_nunique', '_top', '_moments', '_extra')
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self._fields and hasattr(self, '_' + key):
+            value = getattr(self, '_' + key)
+        elif self._extra is not None and key in self._extra:
+            value = self._extra[key]
+        else:
+            raise KeyError(key)
+        return value.series() if isinstance(value, _CompactSeries) else value
+
+    def __setitem__(self, key, value):
+        if isinstance(value, pd.Series):
+            value = _CompactSeries.pack(value)
+        if key in self._fields:
+            setattr(self, '_' + key, value)
+        else:
+            if self._extra is None:
+                self._extra = OrderedDict()
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fields and hasattr(self, '_' + key):
+            delattr(self, '_' + key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return hasattr(self, '_' + key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in self._fields:
+            if hasattr(self, '_' + key):
+                yield key
+        for key in self._extra or ():
+            yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __getattr__(self, name):
+        '''Getting col.x gets col["x"]'''
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        '''Setting col.x sets col["x"]'''
+        if name.startswith('_'):
+            return super(Column, self).__setattr__(name, value)
+        self[name] = value
+
+    def __delattr__(self, name):
+        '''Deleting col.x deletes col["x"]'''
+        if name.startswith('_'):
+            return super(Column, self).__delattr__(name)
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self.items()))
+
     def __str__(self, rows=100):
         '''
         Display a column as follows::
@@ -485,13 +1848,107 @@ class Column(MetaDict):
             return '%s (%s): %s' % (self.name, self.type_pandas, top)
 
 
+class _CompactSeries(object):
+    '''A small Series stored as its index and values arrays. Use .series() to get it'''
+    __slots__ = ('index', 'values', 'name', 'index_name')
+
+    @classmethod
+    def pack(cls, series):
+        '''Return a _CompactSeries for series, or series itself if it cannot be packed'''
+        index = series.index
+        if isinstance(index, pd.MultiIndex) or not isinstance(index.dtype, np.dtype) or \
+                not isinstance(series.dtype, np.dtype):
+            return series
+        self = cls()
+        # Copy, so that slices like value_counts().head() do not hold the parent's memory
+        self.index, self.values = np.array(index.values), np.array(series.values)
+        self.name, self.index_name = series.name, index.name
+        return self
+
+    def series(self):
+        index = pd.Index(self.index, dtype=self.index.dtype, name=self.index_name)
+        return pd.Series(self.values, index=index, name=self.name)
+
+
+class _CompactFrame(object):
+    '''A small DataFrame stored pickled. Use .frame() to get it'''
+    __slots__ = ('data', )
+
+    def __init__(self, frame):
+        self.data = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def frame(self):
+        return pickle.loads(self.data)
+
+
+def to_primitives(obj):
+    '''
+    Convert a metadata tree into AttrDicts, lists, strings, numbers and None.
+    The result is what ``json.loads(tree.to_json())`` returns, but without
+    serialising the tree to JSON. ``to_yaml()`` dumps this. Series become
+    ``{index: value}`` AttrDicts, and DataFrames become ``{columns, index,
+    data}`` like Pandas' split orient. Dict keys are converted to strings like
+    ``json.dumps`` does. NumPy scalars become Python numbers, dates and times
+    ISO 8601 strings, and timedeltas strings like ``1 days 02:00:00``. Other
+    types raise a TypeError.
+    '''
+    if isinstance(obj, _CompactFrame):
+        obj = obj.frame()
+    if isinstance(obj, pd.DataFrame):
+        # Pandas' C encoder and json's C decoder are faster than converting values in Python
+        return json.loads(obj.to_json(orient='split'), object_pairs_hook=AttrDict)
+    elif isinstance(obj, pd.Series):
+        result = json.loads(obj.to_json(orient='split'), object_pairs_hook=AttrDict)
+        return AttrDict((_json_key(key), value) for key, value in zip(result.index, result.data))
+    elif isinstance(obj, (dict, Column)):
+        return AttrDict((_json_key(key), to_primitives(value)) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return [to_primitives(value) for value in obj]
+    elif isinstance(obj, string_types):
+        return obj if isinstance(obj, text_type) else obj.decode('utf-8')
+    elif isinstance(obj, bool) or obj is None:
+        return obj
+    elif isinstance(obj, integer_types):
+        return int(obj)
+    elif isinstance(obj, float):
+        return float(obj)
+    elif obj is pd.NaT:
+        return None
+    elif isinstance(obj, np.datetime64):
+        return to_primitives(pd.Timestamp(obj))
+    elif isinstance(obj, np.timedelta64):
+        return to_primitives(pd.Timedelta(obj))
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif isinstance(obj, datetime.timedelta):
+        return text_type(pd.Timedelta(obj))
+    raise TypeError('%s is not JSON serializable' % type(obj).__name__)
+
+
+def _json_key(key):
+    '''Convert a dict key to a string the way json.dumps does'''
+    if isinstance(key, string_types):
+        return key if isinstance(key, text_type) else key.decode('utf-8')
+    if key is None or isinstance(key, (bool, float) + integer_types):
+        return json.dumps(key)
+    raise TypeError('keys must be str, int, float, bool or None, not %s' % type(key).__name__)
+
+
 class PandasEncoder(json.JSONEncoder):
     def default(self, obj):
+        if isinstance(obj, Column):
+            return AttrDict(obj.items())
+        elif isinstance(obj, _CompactFrame):
+            obj = obj.frame()
         if isinstance(obj, pd.Series):
             result = json.loads(obj.to_json(orient='split'))
             return AttrDict(zip(result['index'], result['data']))
         elif isinstance(obj, pd.DataFrame):
             return json.loads(obj.to_json(orient='split'))
+        elif isinstance(obj, (np.generic, datetime.date, datetime.time, datetime.timedelta)):
+            return to_primitives(obj)
         return json.JSONEncoder.default(self, obj)
 
 
@@ -499,36 +1956,999 @@ class CSVEncodingError(UnicodeError):
     pass
 
 
-def chunked(method, chunksize):
-    '''Wrap Pandas read_* methods with a specified chunksize and returns the first chunk'''
+class MetaCache(object):
+    '''
+    Caches the profile of each dataset as a pickle under ``folder``. The key
+    is the dataset's command, the path, size and modification time of its
+    source file, and the profiling parameters. So a changed file or different
+    parameters re-profile the dataset.
+
+    ``evict()`` deletes entries unused for ``max_days`` days, and then the
+    least recently used entries until the cache is under ``max_bytes``.
+    '''
+    def __init__(self, folder, max_bytes=2 ** 30, max_days=30):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def key(self, node, **params):
+        '''Return the cache key for a dataset node, or None if it cannot be cached'''
+        cmd = node.get('command', [None])
+        stamp = source_stamp(cmd) if cmd[0] is not None else None
+        if stamp is None:
+            return None
+        params.pop('tqdm_disable', None)
+        key = json.dumps([cmd, stamp, params], sort_keys=True, default=text_type)
+        return md5(key.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + '.pickle')
+
+    def get(self, key):
+        '''Return the cached profile for key, or None'''
+        path = self.path(key)
+        try:
+            with io.open(path, 'rb') as handle:
+                result = pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return result
+
+    def put(self, key, profile):
+        '''Save the profile under key. Write to a temporary file to make this atomic'''
+        path = self.path(key)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with io.open(temp, 'wb') as handle:
+            pickle.dump(profile, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        _replace(temp, path)
+
+    def evict(self):
+        '''Delete entries older than max_days, then the oldest until under max_bytes'''
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        expiry = time.time() - self.max_days * seconds_per_day
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if mtime < expiry or size > self.max_bytes:
+                os.unlink(path)
+                size -= entry_size
+
+
+class ExtractCache(object):
+    '''
+    Caches files and archives extracted from archives under ``folder``. Each
+    entry is named after the MD5 hash of the contents of the file or archive
+    member it was extracted from (see ``content_hash``) and its name. So an
+    unchanged archive is never extracted twice, even if it was touched,
+    moved, or is a member of another archive that changed. Files larger than
+    ``hash_bytes`` are hashed by sampled blocks, which may miss changes. So
+    their size and modification time are part of the hash too.
+
+    ``evict()`` deletes the least recently used entries until the cache is
+    under ``max_bytes``.
+    '''
+    def __init__(self, folder, max_bytes=2 ** 32, hash_bytes=hash_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hash_bytes = hash_bytes
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def key(self, source):
+        '''Return the hash of the file or archive member source'''
+        digest = content_hash(source, self.hash_bytes)
+        stat = None if is_member(source) else os.stat(source)
+        if stat is not None and self.hash_bytes is not None and stat.st_size > self.hash_bytes:
+            stamp = '%s %d %r' % (digest, stat.st_size, stat.st_mtime)
+            digest = md5(stamp.encode('utf-8')).hexdigest()
+        return digest
+
+    def path(self, source, suffix=''):
+        '''Return the path of the entry for the file or archive member source'''
+        name = os.path.split(source.split(member_sep)[-1])[-1]
+        return os.path.join(self.folder, '%s-%s%s' % (self.key(source), name, suffix))
+
+    def get(self, source, extract, suffix=''):
+        '''
+        Return the path of the entry for source. If it does not exist, call
+        ``extract(source, temp)`` to create it at a temporary path, and then
+        rename it. Use a suffix to store different extracts of the same source.
+        '''
+        target = self.path(source, suffix)
+        if os.path.exists(target):
+            # Mark the entry as recently used
+            os.utime(target, None)
+            return target
+        temp = '%s.%d.tmp' % (target, os.getpid())
+        try:
+            extract(source, temp)
+            if os.path.isdir(temp) and os.path.exists(target):
+                # Another process extracted it first. Use that
+                shutil.rmtree(temp)
+            else:
+                _replace(temp, target)
+        except Exception:
+            if os.path.isdir(temp):
+                shutil.rmtree(temp)
+            elif os.path.exists(temp):
+                os.unlink(temp)
+            raise
+        return target
+
+    def evict(self):
+        '''Delete the least recently used entries until under max_bytes'''
+        _evict(self.folder, self.max_bytes)
+
+
+class FrameCache(object):
+    '''
+    Caches DataFrames read by ``Meta.data()`` under ``folder``, with a NumPy
+    file per column. Numeric and date columns are loaded via memory maps.
+    Other columns are dictionary-encoded as integer codes and unique values.
+    Columns that cannot be encoded (e.g. with unhashable values) are pickled.
+
+    The key is the dataset's command, the path, size and modification time of
+    its source file, and the read parameters. So a changed file is re-read.
+    ``evict()`` deletes the least recently used entries until under max_bytes.
+    '''
+    def __init__(self, folder, max_bytes=2 ** 33):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def key(self, cmd, **params):
+        '''Return the cache key for a dataset command, or None if it cannot be cached'''
+        stamp = source_stamp(cmd) if cmd[0] is not None else None
+        if stamp is None:
+            return None
+        key = json.dumps([cmd, stamp, params], sort_keys=True, default=text_type)
+        return md5(key.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        '''Return the cached DataFrame for key, or None'''
+        path = self.path(key)
+        try:
+            with io.open(os.path.join(path, 'frame.pickle'), 'rb') as handle:
+                names, kinds, index = pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        columns = OrderedDict()
+        for pos, kind in enumerate(kinds):
+            target = os.path.join(path, '%d' % pos)
+            if kind == 'array':
+                columns[pos] = np.load(target + '.npy', mmap_mode='r')
+            elif kind == 'codes':
+                with io.open(target + '.pickle', 'rb') as handle:
+                    uniques = pickle.load(handle)
+                # Code -1 (missing) picks the NaN appended at the end
+                columns[pos] = np.append(uniques, np.nan)[np.load(target + '.npy')]
+            else:
+                with io.open(target + '.pickle', 'rb') as handle:
+                    series = pickle.load(handle)
+                # Series.array (pandas >= 0.24) keeps extension dtypes that .values drops
+                columns[pos] = getattr(series, 'array', series.values)
+        if isinstance(index, int):
+            index = pd.RangeIndex(index)
+        # copy=False keeps the memory-mapped arrays as they are, without reading them
+        result = pd.DataFrame(columns, index=index, copy=False)
+        result.columns = names
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return result
+
+    def put(self, key, data):
+        '''Save the DataFrame under key. Write to a temporary folder to make this atomic'''
+        path = self.path(key)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        os.makedirs(temp)
+        try:
+            kinds = []
+            for pos in range(data.shape[1]):
+                kinds.append(_save_column(data.iloc[:, pos], os.path.join(temp, '%d' % pos)))
+            index = data.index
+            if isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1:
+                index = len(index)
+            with io.open(os.path.join(temp, 'frame.pickle'), 'wb') as handle:
+                pickle.dump((list(data.columns), kinds, index), handle,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            _replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                shutil.rmtree(temp)
+
+    def evict(self):
+        '''Delete the least recently used entries until under max_bytes'''
+        _evict(self.folder, self.max_bytes)
+
+
+def _save_column(series, target):
+    '''
+    Save a Series into target.npy and / or target.pickle. Return how it was saved.
+    Extension dtypes (e.g. tz-aware datetimes, categoricals) are pickled whole,
+    since their NumPy values lose the dtype.
+    '''
+    numpy_dtype = isinstance(series.dtype, np.dtype)
+    if numpy_dtype and series.dtype.kind in 'biufcmM':
+        np.save(target + '.npy', series.values)
+        return 'array'
+    try:
+        codes, uniques = pd.factorize(series)
+    except TypeError:
+        codes = None
+    if codes is not None and numpy_dtype:
+        np.save(target + '.npy', codes)
+        with io.open(target + '.pickle', 'wb') as handle:
+            pickle.dump(np.asarray(uniques, dtype=object), handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        return 'codes'
+    with io.open(target + '.pickle', 'wb') as handle:
+        pickle.dump(series, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    return 'pickle'
+
+
+def _evict(folder, max_bytes):
+    '''Delete the least recently used files and folders under folder until under max_bytes'''
+    entries = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith('.tmp'):
+            continue
+        size = os.stat(path).st_size
+        for base, dirs, files in os.walk(path):
+            size += sum(os.stat(os.path.join(base, each)).st_size for each in files)
+        entries.append((os.stat(path).st_mtime, size, path))
+    size = sum(entry[1] for entry in entries)
+    for mtime, entry_size, path in sorted(entries):
+        if size <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+        size -= entry_size
+
+
+def _replace(source, target):
+    '''Atomically rename source to target, overwriting target'''
+    try:
+        os.replace(source, target)
+    except AttributeError:
+        # Python 2 has no os.replace. os.rename overwrites on Unix
+        os.rename(source, target)
+
+
+def read_prefix(path, nbytes=preview_bytes, lines=None):
+    '''
+    Return up to nbytes from the start of the file at path. If the file is
+    larger, truncate to the last complete line. If ``lines`` is specified,
+    stop reading after that many complete lines. This reads in blocks that
+    double from 64KB, so small previews of large (or remote) files are cheap.
+    '''
+    with open_file(path) as handle:
+        if lines is None:
+            data = handle.read(nbytes + 1)
+            complete = len(data) <= nbytes
+        else:
+            data, block, complete = b'', 2 ** 16, False
+            while len(data) <= nbytes and data.count(b'\n') <= lines:
+                chunk = handle.read(min(block, nbytes + 1 - len(data)))
+                if not chunk:
+                    complete = True
+                    break
+                data += chunk
+                block *= 2
+    if complete:
+        return data
+    end = data.rfind(b'\n', 0, min(len(data), nbytes)) + 1
+    # In UTF-16-LE, a newline is followed by a NUL byte. Retain it
+    if data[end:end + 1] == b'\x00':
+        end += 1
+    return data[:end]
+
+
+@read_member
+def read_csv(path, options=None, **kwargs):
+    '''Read a CSV file via ``read_csv_encoded`` with options from the metadata command'''
+    kwargs.update(options or {})
+    return read_csv_encoded(path, **kwargs)
+
+
+@read_member
+def read_json_lines(path, **kwargs):
+    '''
+    Read a JSON Lines file via Pandas ``read_json``. Unless a chunksize is
+    given, parse ``scan_chunksize`` lines at a time to limit memory use.
+    '''
+    if kwargs.get('chunksize') is not None:
+        return pd.read_json(path, lines=True, **kwargs)
+    chunks = list(pd.read_json(path, lines=True, chunksize=scan_chunksize, **kwargs))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+read_excel = read_member(pd.read_excel)
+read_parquet = read_member(pd.read_parquet)
+read_feather = read_member(pd.read_feather)
+
+
+def preview_csv(path, options=None, nrows=preview_rows, nbytes=preview_bytes, **kwargs):
+    '''Read up to nrows rows from the first nbytes of a CSV file'''
+    data = read_prefix(path, nbytes, lines=nrows + 1)
+    return read_csv(io.BytesIO(data), options, nrows=nrows)
+
+
+def schema_csv(path, options=None, **kwargs):
+    '''Return the tuple of column names in a CSV file, reading only its first 64KB'''
+    return tuple(preview_csv(path, options, nrows=0, nbytes=2 ** 16).columns)
+
+
+def count_rows(path, options=None, block=2 ** 24):
+    '''
+    Return the number of rows in a CSV file, excluding the header, without
+    parsing it. Memory-maps the file and counts newlines in blocks of ``block``
+    bytes. In blocks with quotes, only newlines outside quoted fields count.
+    Empty lines are skipped, like ``read_csv`` does. (But lines with only
+    spaces or tabs are counted, though ``read_csv`` skips them too.)
+    UTF-16 and UTF-32 files fall back to the (slower) csv module. Archive
+    members are decompressed and counted block by block.
+    '''
+    options = options or {}
+    encoding = options.get('encoding') or 'utf-8'
+    quote = ord(options.get('quotechar', '"'))
+    if encoding.lower().replace('_', '-').startswith(('utf-16', 'utf-32')):
+        with io.TextIOWrapper(open_file(path), encoding=encoding, newline='') as handle:
+            return max(sum(1 for row in csv.reader(handle) if row) - 1, 0)
+    with open_file(path) as handle:
+        if is_member(path):
+            blocks = iter(lambda: handle.read(block), b'')
+            records = _count_records(
+                (np.frombuffer(data, dtype=np.uint8) for data in blocks), quote)
+        elif os.fstat(handle.fileno()).st_size == 0:
+            records = 0
+        else:
+            handle = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                records = _count_records(_blocks(np.frombuffer(handle, dtype=np.uint8), block),
+                                         quote)
+            finally:
+                handle.close()
+    return max(records - 1, 0)
+
+
+def _blocks(data, block):
+    '''Yield slices of block items from an array'''
+    for start in range(0, len(data), block):
+        yield data[start:start + block]
+
+
+def _count_records(chunks, quote):
+    '''
+    Count non-empty lines in an iterable of uint8 arrays, ignoring newlines
+    inside quotes. Lines with just a carriage return are empty too.
+    '''
+    records, inside = 0, 0
+    # The last 2 bytes seen. The file starts as if after an empty line
+    tail = np.array([10, 10], dtype=np.uint8)
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        newlines = np.flatnonzero(chunk == 10)
+        quotes = np.flatnonzero(chunk == quote)
+        if len(quotes) or inside:
+            # A newline is outside quotes if an even number of quotes precede it
+            before = np.searchsorted(quotes, newlines) + inside
+            newlines = newlines[before % 2 == 0]
+            inside = (inside + len(quotes)) % 2
+        records += len(newlines) - np.count_nonzero(_empty_line(chunk, tail, newlines))
+        tail = np.concatenate([tail, chunk[-2:]])[-2:]
+    # The last line may not end with a newline
+    if tail[-1] != 10 and not (tail[-1] == 13 and tail[-2] == 10):
+        records += 1
+    return int(records)
+
+
+def _empty_line(chunk, tail, ends):
+    '''
+    Return a bool array: is the line ending before each index in ends empty?
+    tail has the 2 bytes before chunk.
+    '''
+    prev = np.where(ends >= 1, chunk[np.maximum(ends - 1, 0)], tail[1])
+    prev2 = np.where(ends >= 2, chunk[np.maximum(ends - 2, 0)],
+                     np.where(ends == 1, tail[1], tail[0]))
+    return (prev == 10) | ((prev == 13) & (prev2 == 10))
+
+
+def preview_json(path, nrows=preview_rows, nbytes=preview_bytes, **kwargs):
+    '''
+    Read up to nrows records from a JSON file. Files up to nbytes are parsed
+    whole. Larger files with a top-level array are parsed incrementally until
+    nrows records are read (see ``iter_json_records``). Others are read as
+    JSON Lines, parsing only the first nrows lines.
+    '''
+    size = file_size(path)
+    if size is None or size <= nbytes:
+        with open_file(path) as handle:
+            data = handle.read(nbytes + 1)
+        if len(data) <= nbytes:
+            try:
+                return read_json(io.BytesIO(data)).head(nrows)
+            except ValueError:
+                pass
+    if _json_start(path) == b'[':
+        return pd.DataFrame(list(islice(iter_json_records(path), nrows)))
+    try:
+        return preview_json_lines(path, nrows=nrows, nbytes=nbytes)
+    except ValueError:
+        raise ValueError('%s is neither JSON under %d bytes nor JSON Lines' % (path, nbytes))
+
+
+# Whitespace and commas between values in a JSON array. See iter_json_records
+_json_gap = re.compile(r'[\s,]*')
+_json_space = re.compile(r'\s*')
+
+
+def iter_json_records(path, block=2 ** 16):
+    '''
+    Yield each value in the top-level array of a UTF-8 JSON file, parsing it
+    incrementally. Memory use depends on the size of each value, not the file.
+    '''
+    decoder = json.JSONDecoder()
+    with io.TextIOWrapper(open_file(path), encoding='utf-8-sig') as handle:
+        buffer, pos, eof, started = '', 0, False, False
+        while True:
+            # Skip whitespace and the commas between values
+            pos = _json_gap.match(buffer, pos).end()
+            if pos < len(buffer):
+                if not started:
+                    if buffer[pos] != '[':
+                        raise ValueError('%s does not have a top-level array' % path)
+                    started, pos = True, pos + 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    end = None
+                # A value is complete only if a , or ] follows it. A number cut at the end
+                # of the buffer (e.g. "1." or "1e") may parse, but is incomplete. So read more
+                if end is not None:
+                    after = _json_space.match(buffer, end).end()
+                    if (after < len(buffer) and buffer[after] in ',]') or (
+                            eof and after == len(buffer)):
+                        yield value
+                        pos = end
+                        continue
+                if eof:
+                    raise ValueError('%s has invalid JSON at %r' % (path, buffer[pos:pos + 20]))
+            elif eof:
+                raise ValueError('%s ends before its array is closed' % path)
+            # Discard parsed text and read more. Read larger blocks for large values
+            if len(buffer) - pos >= block:
+                block *= 2
+            chunk = handle.read(block)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+
+def _json_start(path):
+    '''Return the first byte of a file that is not whitespace or a byte order mark'''
+    with open_file(path) as handle:
+        return handle.read(sniff_bytes).lstrip(b'\xef\xbb\xbf \t\r\n')[:1]
+
+
+def scan_json(path, chunksize=scan_chunksize):
+    '''Yield chunks of records from a JSON file with a top-level array. Read other JSON whole'''
+    if _json_start(path) != b'[':
+        yield read_json(path)
+        return
+    records = iter_json_records(path)
+    while True:
+        chunk = list(islice(records, chunksize))
+        if not chunk:
+            break
+        yield pd.DataFrame(chunk)
+
+
+def preview_json_lines(path, nrows=preview_rows, nbytes=preview_bytes, **kwargs):
+    '''Read up to nrows records from the first nbytes of a JSON Lines file'''
+    lines = read_prefix(path, nbytes, lines=nrows).splitlines()[:nrows]
+    text = b'\n'.join(line for line in lines if line.strip()).decode('utf-8')
+    return pd.read_json(io.StringIO(text), lines=True)
+
+
+def preview_parquet(path, nrows=preview_rows, **kwargs):
+    '''Read up to nrows rows from the first row group of a Parquet file'''
+    import pyarrow.parquet as pq
+    with open_file(path) as handle:
+        parquet = pq.ParquetFile(handle)
+        if parquet.num_row_groups == 0:
+            return parquet.schema_arrow.empty_table().to_pandas()
+        return parquet.read_row_group(0).to_pandas().head(nrows)
+
+
+def preview_feather(path, nrows=preview_rows, **kwargs):
+    '''Read up to nrows rows from the first record batch of a Feather (Arrow IPC) file'''
+    import pyarrow as pa
+    with open_file(path) as handle:
+        reader = pa.ipc.open_file(handle)
+        if reader.num_record_batches == 0:
+            return reader.schema.empty_table().to_pandas()
+        return reader.get_batch(0).to_pandas().head(nrows)
+
+
+def footer_parquet(path, **kwargs):
+    '''
+    Return a Meta with the ``rows`` in a Parquet file, and for each column
+    the ``missing`` count, ``min`` and ``max`` from the row group statistics.
+    Statistics missing in any row group are skipped. Does not read any data.
+    '''
+    import pyarrow.parquet as pq
+    with open_file(path) as handle:
+        footer = pq.ParquetFile(handle).metadata
+    columns, bounds = Columns(), {}
+    for group in range(footer.num_row_groups):
+        row_group = footer.row_group(group)
+        for index in range(row_group.num_columns):
+            chunk = row_group.column(index)
+            name, stats = chunk.path_in_schema, chunk.statistics
+            col = columns.setdefault(name, Column(missing=0))
+            if stats is None or not stats.has_null_count:
+                col.missing = None
+            elif col.missing is not None:
+                col.missing += stats.null_count
+            # bounds[name] is None if any row group has no min / max
+            if stats is None or not stats.has_min_max:
+                bounds[name] = None
+            elif bounds.get(name, ()) is not None:
+                low, high = bounds.get(name, (stats.min, stats.max))
+                bounds[name] = min(low, stats.min), max(high, stats.max)
+    for name, col in columns.items():
+        if col.missing is None:
+            del col['missing']
+        if bounds.get(name) is not None:
+            col.min, col.max = bounds[name]
+    return Meta(rows=footer.num_rows, columns=columns)
+
+
+def footer_feather(path, **kwargs):
+    '''
+    Return a Meta with the ``rows`` in a Feather (Arrow IPC) file. This reads
+    the file footer and the header of each record batch, but not their data.
+    '''
+    with open_file(path) as handle:
+        # The file ends with the footer, its size as an int32, and "ARROW1"
+        handle.seek(-10, io.SEEK_END)
+        size, magic = struct.unpack(str('<i6s'), handle.read(10))
+        if magic != b'ARROW1':
+            raise ValueError('%s is not a Feather (Arrow IPC) file' % path)
+        handle.seek(-10 - size, io.SEEK_END)
+        footer = handle.read(size)
+        # Footer.recordBatches (field 3) is a vector of Block structs:
+        # int64 offset, int32 metaDataLength, 4 bytes padding, int64 bodyLength
+        pos, blocks = _flatbuffer_field(footer, _flatbuffer_offset(footer, 0), 3), []
+        if pos is not None:
+            start = _flatbuffer_offset(footer, pos)
+            count = struct.unpack_from(str('<I'), footer, start)[0]
+            blocks = [struct.unpack_from(str('<qi4xq'), footer, start + 4 + 24 * index)
+                      for index in range(count)]
+        rows = 0
+        for offset, length, _ in blocks:
+            handle.seek(offset)
+            message = handle.read(length)
+            # Messages start with an optional 0xFFFFFFFF marker and an int32 size
+            message = message[8:] if message[:4] == b'\xff\xff\xff\xff' else message[4:]
+            # Message.header (field 2) is a RecordBatch. Its length (field 0) is the rows
+            pos = _flatbuffer_field(message, _flatbuffer_offset(message, 0), 2)
+            pos = _flatbuffer_field(message, _flatbuffer_offset(message, pos), 0)
+            if pos is not None:
+                rows += struct.unpack_from(str('<q'), message, pos)[0]
+    return Meta(rows=rows, columns=Columns())
+
+
+def _flatbuffer_offset(buf, pos):
+    '''Return the position that the FlatBuffers offset at pos in buf points to'''
+    return pos + struct.unpack_from(str('<I'), buf, pos)[0]
+
+
+def _flatbuffer_field(buf, table, field):
+    '''Return the position of a field (by index) in a FlatBuffers table, or None if absent'''
+    vtable = table - struct.unpack_from(str('<i'), buf, table)[0]
+    if 4 + 2 * field >= struct.unpack_from(str('<H'), buf, vtable)[0]:
+        return None
+    offset = struct.unpack_from(str('<H'), buf, vtable + 4 + 2 * field)[0]
+    return table + offset if offset else None
+
+
+def update_footer(node, footer):
+    '''Update a profiled node with the exact rows, missing counts and min / max from a footer'''
+    node.rows = footer.rows
+    for name, stats in footer.columns.items():
+        col = node.columns.get(name)
+        if col is None:
+            continue
+        if 'missing' in stats:
+            col.missing = stats.missing
+        if 'moments' in col and 'min' in stats:
+            moments = col.moments
+            moments['min'], moments['max'] = stats.min, stats.max
+            col.moments = moments
+
+
+def estimate_rows(path, options=None, header=1, nbytes=remote_bytes):
+    '''
+    Estimate the number of rows in a CSV or JSON Lines file from its size
+    and the number of lines in its first nbytes, excluding ``header`` lines.
+    This is exact if the file is smaller than nbytes.
+    '''
+    options = options or {}
+    data = read_prefix(path, nbytes)
+    records = _count_records([np.frombuffer(data, dtype=np.uint8)],
+                             ord(options.get('quotechar', '"')))
+    size = file_size(path)
+    if len(data) < size:
+        records = size * records / len(data)
+    return max(int(round(records)) - header, 0)
+
+
+def preview_excel(path, sheet, nrows=preview_rows, **kwargs):
+    '''Read up to nrows rows from an Excel sheet, using the shared workbook'''
+    return pd.read_excel(get_workbook(path), sheet, nrows=nrows)
+
+
+def sheet_rows(path, sheet):
+    '''
+    Return the rows in an Excel sheet, excluding the header, from the sheet's
+    dimensions in the workbook. Returns None if the sheet has no dimensions.
+    '''
+    get_workbook(path)
+    rows = _workbooks[path][2].get(sheet)
+    return None if rows is None else max(rows - 1, 0)
+
+
+def get_workbook(path):
+    '''
+    Return a Pandas ExcelFile for the workbook at path, opened once and shared
+    across its sheets. xlsx files are opened read-only, so sheets are streamed.
+    Call ``close_workbooks()`` to close them.
+    '''
+    with _workbook_lock:
+        if path not in _workbooks:
+            handle = open_file(path)
+            try:
+                workbook = pd.ExcelFile(handle)
+            except Exception:
+                handle.close()
+                raise
+            # Pandas resets openpyxl's sheet dimensions when reading, so note them now
+            book = workbook.book
+            if hasattr(book, 'sheet_by_name'):
+                rows = {sheet.name: sheet.nrows for sheet in book.sheets()}
+            else:
+                rows = {sheet.title: sheet.max_row for sheet in book.worksheets}
+            _workbooks[path] = handle, workbook, rows
+        return _workbooks[path][1]
+
+
+def close_workbooks():
+    '''Close all workbooks opened by ``get_workbook``. Called automatically when Python exits'''
+    with _workbook_lock:
+        for handle, workbook, rows in _workbooks.values():
+            workbook.close()
+            handle.close()
+        _workbooks.clear()
+
+
+atexit.register(close_workbooks)
+
+
+def preview_hdf(path, key, nrows=preview_rows, **kwargs):
+    '''
+    Read up to nrows rows from a HDF5 node, using the shared store. Table
+    nodes read only the rows selected. Fixed nodes slice each numeric array on
+    disk, but read object (e.g. string) columns fully.
+    '''
+    return get_store(path).select(key, start=0, stop=nrows)
+
+
+def hdf_rows(path, key):
+    '''Return the rows in a HDF5 node from its attributes, or None if unknown'''
+    storer = get_store(path).get_storer(key)
+    if storer.is_table:
+        return int(storer.nrows)
+    shape = getattr(storer, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+def get_store(path):
+    '''
+    Return a read-only Pandas HDFStore for path, opened once and shared across
+    its nodes. Call ``close_stores()`` to close them.
+    '''
+    with _store_lock:
+        if path not in _stores:
+            _stores[path] = pd.HDFStore(path, mode='r')
+        return _stores[path]
+
+
+def close_stores():
+    '''Close all HDF5 stores opened by ``get_store``. Called automatically when Python exits'''
+    with _store_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+atexit.register(close_stores)
+
+
+def preview_sql(table, source, nrows=preview_rows, **kwargs):
+    '''Read up to nrows rows from a SQL table using LIMIT'''
+    query = sa.select([sa.text('*')]).select_from(sa.table(table)).limit(nrows)
+    return pd.read_sql(query, get_engine(source))
+
+
+def sample_sql(table, source, nrows=preview_rows, method='system', seed=None, **kwargs):
+    '''
+    Read a random sample of about nrows rows from a SQL table, using the
+    database's cheapest sampling method:
+
+    - PostgreSQL: ``TABLESAMPLE`` (``method='system'`` samples random pages,
+      ``method='bernoulli'`` samples random rows but scans the table), sized
+      from the planner's row estimate
+    - SQLite: random rowids between the smallest and largest rowid
+    - Others, or if the row count is unknown: the first nrows rows
+    '''
+    engine = get_engine(source)
+    sampler = _sample_sql.get(engine.dialect.name)
+    try:
+        with engine.connect() as conn:
+            data = sampler(conn, table, nrows, method=method, seed=seed) if sampler else None
+    except sa.exc.DBAPIError:
+        # e.g. SQLite tables WITHOUT ROWID, or PostgreSQL before 9.5
+        logging.exception('Unable to sample %s:%s. Using first %d rows', source, table, nrows)
+        data = None
+    return preview_sql(table, source, nrows=nrows) if data is None else data
+
+
+def _sample_postgresql(conn, table, nrows, method='system', **kwargs):
+    query = sa.text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)')
+    name = conn.dialect.identifier_preparer.quote(table)
+    total = conn.execute(query, {'table': name}).scalar()
+    # reltuples is 0 or -1 if the table was never analyzed
+    if not total or total <= nrows:
+        return None
+    percent = 100.0 * nrows / total
+    sampled = sa.tablesample(sa.table(table), getattr(sa.func, method)(percent))
+    return pd.read_sql(sa.select([sa.text('*')]).select_from(sampled), conn)
+
+
+def _sample_sqlite(conn, table, nrows, seed=None, **kwargs):
+    query = sa.select([sa.func.min(sa.text('rowid')), sa.func.max(sa.text('rowid'))])
+    low, high = conn.execute(query.select_from(sa.table(table))).fetchone()
+    if low is None or high - low + 1 <= nrows:
+        return None
+    # rowids are integers, so it's safe to embed them in the query
+    rowids = sorted(random.Random(seed).sample(range(low, high + 1), nrows))
+    where = sa.text('rowid IN (%s)' % ','.join(str(rowid) for rowid in rowids))
+    query = sa.select([sa.text('*')]).select_from(sa.table(table)).where(where)
+    return pd.read_sql(query, conn)
+
+
+def count_sql(table, source, **kwargs):
+    '''
+    Return a Meta with the ``rows`` in a SQL table. Use the planner's estimate
+    if the table has statistics (see ``catalog_sql``), and list ``rows`` in
+    ``estimated``. Else run an exact ``COUNT(*)``.
+    '''
+    engine = get_engine(source)
+    method = _catalog_stats.get(engine.dialect.name)
+    with engine.connect() as conn:
+        catalog = method(conn, table, get_inspector(source)) if method else None
+        if catalog is not None:
+            return Meta(rows=catalog[0], estimated=['rows'])
+        query = sa.select([sa.func.count()]).select_from(sa.table(table))
+        return Meta(rows=int(conn.execute(query).scalar()))
+
+
+def read_sql(table, source, **kwargs):
+    '''Read a SQL table via Pandas ``read_sql_table`` using the shared engine for source'''
+    return pd.read_sql_table(table, get_engine(source), **kwargs)
+
+
+_preview_command = {
+    'csv': preview_csv,
+    'json': preview_json,
+    'jsonl': preview_json_lines,
+    'sql': preview_sql,
+    'xlsx': preview_excel,
+    'hdf5': preview_hdf,
+    'parquet': preview_parquet,
+    'feather': preview_feather,
+}
+
+# Methods that return the rows stored in a file's metadata, or None
+_rows_command = {
+    'xlsx': sheet_rows,
+    'hdf5': hdf_rows,
+}
+
+# Methods that read metadata stored in the file, without reading data
+_footer_command = {
+    'parquet': footer_parquet,
+    'feather': footer_feather,
+}
+
+
+_sample_command = {
+    'sql': sample_sql,
+}
+
+# Methods that return the rows of datasets previewed via _sample_command
+_sample_rows_command = {
+    'sql': count_sql,
+}
+
+
+_sample_sql = {
+    'postgresql': _sample_postgresql,
+    'sqlite': _sample_sqlite,
+}
+
+
+_schema_command = {
+    'csv': schema_csv,
+}
+
+_count_command = {
+    'csv': count_rows,
+}
+
+
+def scanned(method, chunksize):
+    '''Wrap Pandas read_* methods with a specified chunksize and return the chunk iterator'''
     @wraps(method)
     def wrapped(*args, **kwargs):
         kwargs['chunksize'] = chunksize
-        result = method(*args, **kwargs)
-        return next(result)
-    return method
+        return method(*args, **kwargs)
+    return wrapped
 
 
-_preview_command = {
-    'csv': chunked(read_csv_encoded, 10000),
-    'json': read_json,
-    'sql': chunked(pd.read_sql_table, 10000),
-    'xlsx': pd.read_excel,
-    'hdf5': chunked(pd.read_hdf, 10000),
+def scan_excel(path, sheet):
+    '''Yield an Excel sheet as a single chunk, read from the shared workbook'''
+    yield pd.read_excel(get_workbook(path), sheet)
+
+
+def scan_hdf(path, key, chunksize=scan_chunksize):
+    '''Yield chunks of the HDF5 node key at path. Works for both table and fixed formats'''
+    store = get_store(path)
+    for start in range(0, hdf_rows(path, key), chunksize):
+        yield store.select(key, start=start, stop=start + chunksize)
+
+
+def scan_parquet(path):
+    '''Yield each row group of a Parquet file as a chunk'''
+    import pyarrow.parquet as pq
+    with open_file(path) as handle:
+        parquet = pq.ParquetFile(handle)
+        for group in range(parquet.num_row_groups):
+            yield parquet.read_row_group(group).to_pandas()
+
+
+def scan_feather(path):
+    '''Yield each record batch of a Feather (Arrow IPC) file as a chunk'''
+    import pyarrow as pa
+    with open_file(path) as handle:
+        reader = pa.ipc.open_file(handle)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index).to_pandas()
+
+
+# Methods to estimate rows of remote files without downloading them
+_estimate_command = {
+    'csv': estimate_rows,
+    'jsonl': lambda path: estimate_rows(path, header=0),
+}
+
+_catalog_command = {
+    'sql': catalog_sql,
+}
+
+_catalog_stats = {
+    'postgresql': _catalog_postgresql,
+    'sqlite': _catalog_sqlite,
+}
+
+_pushdown_command = {
+    'sql': profile_sql,
+}
+
+_scan_command = {
+    'csv': scanned(read_csv, scan_chunksize),
+    'json': scan_json,
+    'jsonl': scanned(read_json_lines, scan_chunksize),
+    'sql': scanned(read_sql, scan_chunksize),
+    'xlsx': scan_excel,
+    'hdf5': scan_hdf,
+    'parquet': scan_parquet,
+    'feather': scan_feather,
 }
 
 _read_command = {
-    'csv': read_csv_encoded,
+    'csv': read_csv,
     'json': read_json,
-    'sql': pd.read_sql_table,
-    'xlsx': pd.read_excel,
+    'jsonl': read_json_lines,
+    'sql': read_sql,
+    'xlsx': read_excel,
     'hdf5': pd.read_hdf,
+    'parquet': read_parquet,
+    'feather': read_feather,
+}
+
+# Standard deviation functions by SQLAlchemy dialect name
+_stddev = {
+    'postgresql': 'stddev_samp',
+    'mysql': 'stddev_samp',
+    'oracle': 'stddev_samp',
+    'mssql': 'stdev',
 }
 
 _ext_map = {
     '7zip': '7z',
     'db': 'sqlite3',
     'h5': 'hdf5',
+    'ndjson': 'jsonl',
+    'pq': 'parquet',
+    'arrow': 'feather',
+}
+
+# File signatures / magic are from http://www.garykessler.net/library/file_sigs.html
+_magic = (
+    (b'7z\xbc\xaf\x27\x1c', '7z'),
+    (b'Rar!\x1A\x07', 'rar'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'SQLite format 3\x00', 'sqlite3'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'xls'),
+    (b'\x89\x48\x44\x46\x0d\x0a\x1a\x0a', 'hdf5'),
+    (b'PAR1', 'parquet'),
+    (b'ARROW1', 'feather'),
+)
+
+# Byte order marks and encodings that strip them. UTF-32 must precede UTF-16
+_bom = (
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+)
+
+# Formats that open_file reads without extracting. Methods return the
+# (archive and member) handles opened, and the member's size if known
+_archive_open = {
+    'zip': _open_zip,
+    'tar': _open_tar,
+    'gz': lambda handle, name: ([gzip.GzipFile(fileobj=handle, mode='rb')], None),
+    'bz2': lambda handle, name: ([bz2.BZ2File(handle)], None),
+    'xz': _open_xz,
+}
+
+_archive_list = {
+    'zip': _list_zip,
+    'tar': _list_tar,
 }
 
 _format_map = {
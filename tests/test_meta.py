@@ -1,16 +1,45 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import io
 import os
+import json
+import time
 import shutil
 import unittest
+import requests
+import threading
 import subprocess
+import numpy as np
 import pandas as pd
-from nose.tools import eq_
+import sqlalchemy as sa
+from nose.tools import eq_, ok_
+from six.moves import BaseHTTPServer
 from autolysis import meta, metadata
+from contextlib import contextmanager
 from pandas.util.testing import assert_frame_equal, assert_series_equal
 
 
+class QuietHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''An HTTP request handler that does not log requests'''
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def local_server(handler):
+    '''Serve HTTP requests with handler in a thread. Yield the server's base URL'''
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d/' % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 class TestMeta(unittest.TestCase):
 
     @classmethod
@@ -53,7 +82,101 @@ class TestMeta(unittest.TestCase):
             os.path.abspath('/path/d8f477152f-file.ext'))
 
     def test_fetch(self):
-        raise unittest.SkipTest('To be implemented')
+        with io.open('x.csv', 'rb') as handle:
+            content = handle.read()
+        statuses = []
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                if self.path.endswith('/missing.csv'):
+                    statuses.append(404)
+                    self.send_error(404)
+                elif self.headers.get('If-None-Match') == '"x"':
+                    statuses.append(304)
+                    self.send_response(304)
+                    self.end_headers()
+                else:
+                    statuses.append(200)
+                    self.send_response(200)
+                    self.send_header('ETag', '"x"')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+
+        with local_server(Handler) as url:
+            path = os.path.join(self.root, 'fetch.csv')
+            eq_(meta.fetch(url + 'x.csv', path), path)
+            with io.open(path, 'rb') as handle:
+                eq_(handle.read(), content)
+            # Fresh files are not fetched. Stale files are revalidated
+            meta.fetch(url + 'x.csv', path)
+            eq_(statuses, [200])
+            meta.fetch(url + 'x.csv', path, expiry_days=0)
+            eq_(statuses, [200, 304])
+            with io.open(path, 'rb') as handle:
+                eq_(handle.read(), content)
+            # Errors raise exceptions, and do not leave partial files
+            missing = os.path.join(self.root, 'missing.csv')
+            with self.assertRaises(requests.HTTPError):
+                meta.fetch(url + 'missing.csv', missing)
+            ok_(not os.path.exists(missing))
+            targets = [(url + 'x%d.csv' % index, os.path.join(self.root, 'fetch%d.csv' % index))
+                       for index in range(5)]
+            eq_(meta.fetch_all(targets, threads=2), [target[1] for target in targets])
+            eq_(statuses.count(200), 6)
+            m = metadata(url + 'x.csv', root=self.root, tqdm_disable=True)
+            eq_(m.rows, 2)
+
+    def test_remote_preview(self):
+        rows = ('%06d,text %d\n' % (i, i % 7) for i in range(500000))
+        content = ('a,b\n' + ''.join(rows)).encode('utf-8')
+        served, sizes = [], {'Content-Length': True, 'Content-Range': True}
+
+        class Handler(QuietHandler):
+            def do_HEAD(self):
+                self.send_response(200)
+                if sizes['Content-Length']:
+                    self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+
+            def do_GET(self):
+                data, status = content, 200
+                if 'Range' in self.headers:
+                    start, end = self.headers['Range'].split('=')[1].split('-')
+                    data, status = content[int(start):int(end) + 1], 206
+                served.append(len(data))
+                self.send_response(status)
+                if status == 206:
+                    total = len(content) if sizes['Content-Range'] else '*'
+                    self.send_header('Content-Range', 'bytes %s-%d/%s' % (
+                        start, int(start) + len(data) - 1, total))
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        with local_server(Handler) as base:
+            url = base + 'big.csv?version=1'
+            root = os.path.join(self.root, 'remote')
+            os.makedirs(root)
+            m = metadata(url, root=root, download=False, nrows=100, tqdm_disable=True)
+            eq_(os.listdir(root), [])
+            ok_(sum(served) < len(content) / 2)
+            self.assertDictContainsSubset({'format': 'csv', 'size': len(content)}, m)
+            eq_(m.estimated, ['rows'])
+            ok_(abs(m.rows - 500000) < 25000)
+            expected = pd.read_csv(io.BytesIO(content))
+            assert_frame_equal(m['head'], expected.head(10))
+            eq_(m.columns.b.nunique, 7)
+            # Meta.data() reads the whole file
+            assert_frame_equal(m.data(), expected)
+            # Without Content-Length, the size is taken from Content-Range
+            sizes['Content-Length'] = False
+            eq_(meta.HTTPFile(url).size, len(content))
+            # Without either, the file is downloaded
+            sizes['Content-Range'] = False
+            m = metadata(url, root=root, download=False, nrows=100, tqdm_disable=True)
+            ok_(any(name.endswith('big.csv') for name in os.listdir(root)))
+            eq_(m.rows, 500000)
 
     def test_guess_format(self):
         formats = [
@@ -75,7 +198,50 @@ class TestMeta(unittest.TestCase):
             eq_(meta.guess_format(path, True), fmt)
 
     def test_read_csv_encoded(self):
-        raise unittest.SkipTest('To be implemented')
+        data = pd.read_csv('x.csv', encoding='cp1252')
+        for encoding, detected in (('cp1252', 'cp1252'), ('utf-8', 'utf-8'),
+                                   ('utf-8-sig', 'utf-8-sig'), ('utf-16', 'utf-16'),
+                                   ('utf-16-le', 'utf-16-le'), ('utf-16-be', 'utf-16-be')):
+            path = os.path.join(self.root, 'encoded-%s.csv' % encoding)
+            data.to_csv(path, index=False, encoding=encoding)
+            eq_(meta.detect_encoding(path), detected)
+            assert_frame_equal(meta.read_csv_encoded(path), data)
+            with io.open(path, 'rb') as handle:
+                eq_(meta.detect_encoding(handle), detected)
+                eq_(handle.tell(), 0)
+        # The encoding is detected once and saved in the command
+        m = metadata(os.path.join(self.root, 'encoded-utf-16.csv'), tqdm_disable=True)
+        eq_(m.command[-1]['encoding'], 'utf-16')
+        eq_(m.rows, 2)
+        with self.assertRaises(meta.CSVEncodingError):
+            meta.detect_encoding('x.csv', encodings=('ascii', ))
+        # A non-UTF-8 byte after an ASCII sample is still read
+        path = os.path.join(self.root, 'late-cp1252.csv')
+        lines = meta.encoding_bytes // 8 + 1
+        with io.open(path, 'wb') as handle:
+            handle.write(b'a,b\n' + b'123,xyz\n' * lines + b'1,caf\xe9\n')
+        eq_(meta.detect_encoding(path), 'cp1252')
+        eq_(meta.detect_encoding(path, nbytes=2 ** 30), 'cp1252')
+        m = metadata(path, tqdm_disable=True)
+        result = m.data()
+        eq_(len(result), lines + 1)
+        eq_(result['b'].iloc[-1], 'caf\xe9')
+        # ... and so is UTF-8 text after an ASCII sample
+        path = os.path.join(self.root, 'late-utf-8.csv')
+        with io.open(path, 'wb') as handle:
+            handle.write(b'a,b\n' + b'123,xyz\n' * lines + '2,中文ā\n'.encode('utf-8'))
+        eq_(meta.detect_encoding(path), 'utf-8')
+        with io.open(path, 'rb') as handle:
+            eq_(meta.detect_encoding(handle), 'utf-8')
+            eq_(handle.tell(), 0)
+        result = metadata(path, tqdm_disable=True).data()
+        eq_(len(result), lines + 1)
+        eq_(result['b'].iloc[-1], '中文ā')
+        # A long file that is all ASCII is UTF-8
+        path = os.path.join(self.root, 'long-ascii.csv')
+        with io.open(path, 'wb') as handle:
+            handle.write(b'a,b\n' + b'123,xyz\n' * lines)
+        eq_(meta.detect_encoding(path), 'utf-8')
 
     def test_extract_archive(self):
         mapping = [
@@ -92,6 +258,66 @@ class TestMeta(unittest.TestCase):
     def test_unzip_files(self):
         raise unittest.SkipTest('To be implemented')
 
+    def test_archive_members(self):
+        members = [
+            ('xy.zip', {'x.csv', 'y.csv', 'z.json'}),
+            ('xy.tar', {'x.csv', 'y.csv', 'z.json'}),
+            ('x.csv.gz', {'x.csv'}),
+            ('x.csv.bz2', {'x.csv'}),
+            ('x.csv.xz', {'x.csv'}),
+            ('xy.tar.gz', {'xy.tar'}),
+        ]
+        for archive, names in members:
+            result = dict(meta.archive_members(archive, meta.guess_format(archive)))
+            eq_(set(result), names)
+            for name, path in result.items():
+                eq_(path, archive + '::' + name)
+        # Members, including nested members, are read without extracting them
+        with io.open('x.csv', 'rb') as handle:
+            expected = handle.read()
+        for path in ('xy.zip::x.csv', 'x.csv.gz::x.csv', 'xy.tar.gz::xy.tar::x.csv',
+                     'zz.zip::xy.zip::x.csv', 'zz.zip::x.csv.xz::x.csv'):
+            with meta.open_file(path) as handle:
+                eq_(handle.read(), expected)
+        root = os.path.join(self.root, 'members')
+        os.makedirs(root)
+        m = metadata('xy.tar.gz', root=root, tqdm_disable=True)
+        eq_(os.listdir(root), [])
+        data = m.datasets['xy.tar'].datasets['x.csv']
+        eq_(data.rows, 2)
+        assert_frame_equal(data['head'], pd.read_csv('x.csv', encoding='cp1252'))
+        assert_frame_equal(data.data(), pd.read_csv('x.csv', encoding='cp1252'))
+        chunks = meta._scan_command['csv'](*data.command[1:])
+        assert_frame_equal(pd.concat(chunks), pd.read_csv('x.csv', encoding='cp1252'))
+        eq_(meta.count_rows(*data.command[1:]), 2)
+
+    def test_extract_cache(self):
+        root = os.path.join(self.root, 'extract-cache')
+        source = os.path.join(self.root, 'zz-copy.zip')
+        shutil.copy('zz.zip', source)
+        m = metadata(source, root=root, tqdm_disable=True)
+        url = m.datasets['xy.db'].datasets.x.command[2]
+        path = url[len('sqlite:///'):]
+        eq_(os.path.dirname(path), os.path.join(root, 'extract'))
+        # Re-running on an unchanged (but touched) archive does not extract again
+        inode = os.stat(path).st_ino
+        os.utime(source, None)
+        m = metadata(source, root=root, tqdm_disable=True)
+        eq_(m.datasets['xy.db'].datasets.x.command[2], url)
+        eq_(os.stat(path).st_ino, inode)
+        eq_(len(os.listdir(os.path.join(root, 'extract'))), 2)
+        # Entries are shared by content, and evicted least recently used first
+        cache = meta.ExtractCache(os.path.join(root, 'extract'), max_bytes=0)
+        eq_(cache.path(source + '::xy.db'), path)
+        # Files hashed by sampled blocks are keyed by their modification time too
+        eq_(cache.key(source), meta.content_hash(source))
+        sampled = meta.ExtractCache(os.path.join(root, 'extract'), hash_bytes=10)
+        key = sampled.key(source)
+        os.utime(source, (time.time() + 10, time.time() + 10))
+        ok_(sampled.key(source) != key)
+        cache.evict()
+        eq_(os.listdir(os.path.join(root, 'extract')), [])
+
     def test_metadata(self):
         m = self.result['x.csv']
         self.assertDictContainsSubset({
@@ -145,3 +371,560 @@ class TestMeta(unittest.TestCase):
         children(['x.csv.xz', 'x.csv.gz', 'x.csv.bz2'], ['x.csv'])
         children(['y.csv.xz', 'y.csv.gz', 'y.csv.bz2'], ['y.csv'])
         children(['xy.zip', 'xy.7z', 'xy.rar', 'xy.tar'], ['x.csv', 'y.csv', 'z.json'])
+
+    def test_metadata_full(self):
+        m = metadata('x.csv', full=True, tqdm_disable=True)
+        self.assertDictContainsSubset({'source': 'x.csv', 'format': 'csv', 'rows': 2}, m)
+        data = pd.read_csv('x.csv', encoding='cp1252')
+        assert_frame_equal(m['head'], data)
+        assert_frame_equal(m['sample'], data)
+        self.assertDictContainsSubset({
+            'name': 'à',
+            'type_pandas': 'int64',
+            'missing': 0,
+            'nunique': 2,
+        }, m['columns']['à'])
+        assert_series_equal(
+            m['columns']['à']['moments'],
+            pd.Series([2.0, 2.0, 1.4142135624, 1.0, 3.0],
+                      index=['count', 'mean', 'std', 'min', 'max'], name='à'))
+        self.assertDictContainsSubset({
+            'name': 'Unnamed: 2',
+            'type_pandas': 'object',
+            'missing': 1,
+            'nunique': 1,
+        }, m['columns']['Unnamed: 2'])
+
+    def test_preview(self):
+        # Previews of all formats return at most nrows rows
+        previews = [
+            ('xy.xlsx', ['xlsx', 'xy.xlsx', 'y']),
+            ('y.h5', ['hdf5', 'y.h5', '/y']),
+            ('xy.db', ['sql', 'y', 'sqlite:///xy.db']),
+            ('y.csv', ['csv', 'y.csv']),
+            ('z.json', ['json', 'z.json']),
+        ]
+        for path, cmd in previews:
+            data = meta._preview_command[cmd[0]](*cmd[1:], nrows=1)
+            eq_(len(data), 1)
+
+    def test_preview_bounded(self):
+        # Preview memory and time stay flat as the file size grows
+        try:
+            import tracemalloc
+        except ImportError:
+            raise unittest.SkipTest('tracemalloc requires Python 3.4+')
+
+        row = {'a': 1, 'b': 'text', 'c': 1.5}
+        small, large = 2000, 200000
+        usage = {}
+        for fmt in ('csv', 'jsonl', 'json'):
+            for size in (small, large):
+                path = os.path.join(self.root, 'preview-%d.%s' % (size, fmt))
+                data = pd.DataFrame([row] * size)
+                if fmt == 'csv':
+                    data.to_csv(path, index=False)
+                else:
+                    data.to_json(path, orient='records', lines=fmt == 'jsonl')
+                tracemalloc.start()
+                start = time.time()
+                result = meta._preview_command[fmt](path, nrows=1000, nbytes=50000)
+                usage[fmt, size] = time.time() - start, tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                ok_(0 < len(result) <= 1000)
+            (small_time, small_mem), (large_time, large_mem) = usage[fmt, small], usage[fmt, large]
+            ok_(large_mem < 2 * small_mem, '%s preview memory grows with file size' % fmt)
+            ok_(large_time < 5 * small_time + 0.5, '%s preview time grows with file size' % fmt)
+
+    def test_json_records(self):
+        path = os.path.join(self.root, 'records.json')
+        records = [{'a': index, 'b': [index, {'c': 'x' * index}]} for index in range(1000)]
+        with io.open(path, 'w', encoding='utf-8') as handle:
+            handle.write(' [\n' + ',\n'.join(json.dumps(rec) for rec in records) + ']\n')
+        eq_(list(meta.iter_json_records(path, block=16)), records)
+        data = meta.preview_json(path, nrows=10, nbytes=1000)
+        eq_(data['a'].tolist(), list(range(10)))
+        chunks = list(meta._scan_command['json'](path, chunksize=300))
+        eq_([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        # Numbers at block boundaries, empty arrays, and truncated arrays
+        for text, result in (('[1, 23456, 7]', [1, 23456, 7]), ('[ ]', [])):
+            with io.open(path, 'w', encoding='utf-8') as handle:
+                handle.write(text)
+            eq_(list(meta.iter_json_records(path, block=2)), result)
+        # Numbers cut after a ".", "e", "E" or sign are read in full
+        text = '[0.1, -1e5,1E+3 ,2.5e-3,\n-0.0 , 12345.678e-2, true, null, "a, b]", [1.5, 2e1]]'
+        with io.open(path, 'w', encoding='utf-8') as handle:
+            handle.write(text)
+        for block in range(1, 9):
+            eq_(list(meta.iter_json_records(path, block=block)), json.loads(text))
+        with io.open(path, 'w', encoding='utf-8') as handle:
+            handle.write('[{"a": 1}, {"a"')
+        with self.assertRaises(ValueError):
+            list(meta.iter_json_records(path, block=4))
+        # .json files with JSON Lines are detected as jsonl
+        lines = os.path.join(self.root, 'lines.json')
+        pd.DataFrame({'a': range(1000)}).to_json(lines, orient='records', lines=True)
+        m = metadata(lines, tqdm_disable=True)
+        eq_(m.format, 'jsonl')
+        eq_(len(m.data()), 1000)
+
+    def test_cache(self):
+        folder = os.path.join(self.root, 'cache')
+        path = os.path.join(self.root, 'cached.csv')
+        shutil.copy('x.csv', path)
+        first = metadata(path, root=self.root, cache=True, tqdm_disable=True)
+        eq_(len(os.listdir(folder)), 1)
+        # Unchanged files re-use the cached profile
+        second = metadata(path, root=self.root, cache=True, tqdm_disable=True)
+        eq_(len(os.listdir(folder)), 1)
+        assert_frame_equal(first['sample'], second['sample'])
+        eq_(first['columns'].keys(), second['columns'].keys())
+        # Different profiling parameters, or a modified file, are profiled afresh
+        metadata(path, root=self.root, cache=True, top=1, tqdm_disable=True)
+        eq_(len(os.listdir(folder)), 2)
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        metadata(path, root=self.root, cache=True, tqdm_disable=True)
+        eq_(len(os.listdir(folder)), 3)
+        # Eviction by age and size
+        meta.MetaCache(folder, max_days=1).evict()
+        eq_(len(os.listdir(folder)), 3)
+        meta.MetaCache(folder, max_bytes=0).evict()
+        eq_(len(os.listdir(folder)), 0)
+
+    def test_frame_cache(self):
+        folder = os.path.join(self.root, 'frames')
+        cache = meta.FrameCache(folder)
+        source = os.path.join(self.root, 'frame.csv')
+        data = pd.DataFrame({
+            'n': [1, 2, 3, 4],
+            'f': [1.5, None, 2.5, 3.5],
+            's': ['à', None, 'b', 'à'],
+            'd': pd.to_datetime(['2019-01-01', '2019-01-02', None, '2019-01-04']),
+        }, columns=['n', 'f', 's', 'd'])
+        data.to_csv(source, index=False, encoding='cp1252')
+        m = metadata(source, tqdm_disable=True)
+        expected = m.data(parse_dates=['d'])
+        assert_frame_equal(m.data(cache=cache, parse_dates=['d']), expected)
+        eq_(len(os.listdir(folder)), 1)
+        # Extension dtypes like tz-aware dates keep their dtype
+        tz = pd.DataFrame({'t': pd.date_range('2019-01-01', periods=4, tz='Asia/Kolkata')})
+        cache.put('tz', tz)
+        assert_frame_equal(cache.get('tz'), tz)
+        eq_(str(cache.get('tz')['t'].dtype), 'datetime64[ns, Asia/Kolkata]')
+        shutil.rmtree(os.path.join(folder, 'tz'))
+        # Later reads load the cached columns
+        key = cache.key(m.command, parse_dates=['d'])
+        cached = cache.get(key)
+        assert_frame_equal(cached, expected)
+        # Numeric and date columns are memory-mapped, not copied
+        for col in ('n', 'f', 'd'):
+            ok_(isinstance(np.asarray(cached[col]).base, np.memmap))
+        assert_frame_equal(m.data(cache=cache, parse_dates=['d']), data)
+        # Changing the source invalidates the cache
+        data.loc[0, 's'] = 'changed'
+        data.to_csv(source, index=False, encoding='cp1252')
+        os.utime(source, (time.time() + 10, time.time() + 10))
+        eq_(m.data(cache=cache, parse_dates=['d'])['s'][0], 'changed')
+        eq_(len(os.listdir(folder)), 2)
+        cache.max_bytes = 0
+        cache.evict()
+        eq_(os.listdir(folder), [])
+        # cache=True uses the frames folder under the metadata root
+        m = metadata(source, root=self.root, tqdm_disable=True)
+        assert_frame_equal(m.data(cache=True, parse_dates=['d']), data)
+        eq_(len(os.listdir(folder)), 1)
+
+    def test_dedup(self):
+        folder = os.path.join(self.root, 'dedup')
+        os.makedirs(os.path.join(folder, 'copy'))
+        shutil.copy('x.csv', os.path.join(folder, 'x.csv'))
+        shutil.copy('x.csv', os.path.join(folder, 'copy', 'x2.csv'))
+        shutil.copy('y.csv', os.path.join(folder, 'y.csv'))
+        m = metadata(folder, root=self.root, dedup=True, tqdm_disable=True)
+        copy = m.datasets[os.path.join('copy', 'x2.csv')]
+        eq_(copy.duplicate, ['x.csv'])
+        eq_(copy.rows, m.datasets['x.csv'].rows)
+        ok_('duplicate' not in m.datasets['x.csv'])
+        ok_('duplicate' not in m.datasets['y.csv'])
+        # iter_metadata does not keep profiles. Duplicates just refer to the first copy
+        items = dict(meta.iter_metadata(folder, root=self.root, dedup=True, tqdm_disable=True))
+        copy = items[(os.path.join('copy', 'x2.csv'), )]
+        eq_(copy.duplicate, ['x.csv'])
+        ok_('rows' not in copy)
+        eq_(items[('x.csv', )].rows, m.datasets['x.csv'].rows)
+
+        # Large files are compared by sampled blocks
+        path = os.path.join(folder, 'x.csv')
+        eq_(meta.content_hash(path), meta.content_hash(os.path.join(folder, 'copy', 'x2.csv')))
+        ok_(meta.content_hash(path, hash_bytes=10, block=4) != meta.content_hash(path))
+        ok_(meta.content_hash(path, hash_bytes=10, block=4) !=
+            meta.content_hash('y.csv', hash_bytes=10, block=4))
+
+    def test_schema_sample(self):
+        folder = os.path.join(self.root, 'partitions')
+        os.makedirs(folder)
+        for index in range(10):
+            data = pd.DataFrame({'day': [index] * (index + 1), 'value': range(index + 1)})
+            data.to_csv(os.path.join(folder, 'day%02d.csv' % index), index=False)
+        shutil.copy('y.csv', os.path.join(folder, 'other.csv'))
+        m = metadata(folder, root=self.root, schema_sample=3, tqdm_disable=True)
+        profiled = [name for name, data in m.datasets.items() if 'head' in data]
+        eq_(len(profiled), 4)
+        ok_('other.csv' in profiled)
+        for name, data in m.datasets.items():
+            if name != 'other.csv':
+                eq_(data.rows, int(name[3:5]) + 1)
+            if name not in profiled:
+                ok_(data.columns.see in profiled)
+
+    def test_sniff(self):
+        def write(name, content):
+            path = os.path.join(self.root, name)
+            with io.open(path, 'wb') as handle:
+                handle.write(content)
+            return path
+
+        eq_(meta.sniff('x.csv'), {'format': 'csv', 'delimiter': ',', 'header': True})
+        eq_(meta.sniff(write('semicolon', b'a;b\n1;2\n3;4\n')).delimiter, ';')
+        eq_(meta.sniff(write('tab', b'a\tb\n1\t2\n')).delimiter, '\t')
+        eq_(meta.sniff(write('lines', b'{"a": 1}\n{"a": 2}\n')).format, 'jsonl')
+        eq_(meta.sniff(write('json', b'{"a": [1, 2]}')).format, 'json')
+        eq_(meta.sniff(write('onecol', b'a\n1\n2\n')).format, None)
+        eq_(meta.sniff(write('norows', b'a,b\n')).format, None)
+        # Only the first nbytes are read. Large JSON and JSON Lines are detected from a prefix
+        records = '\n'.join('{"a": %d, "b": "x"}' % i for i in range(5000)).encode('utf-8')
+        eq_(meta.sniff(write('biglines', records), nbytes=1000).format, 'jsonl')
+        eq_(meta.sniff(write('bigjson', b'[\n' + records.replace(b'\n', b',\n') + b']'),
+                       nbytes=1000).format, 'json')
+        # ZIP files are identified as xlsx from their central directory
+        for name in ('xy.xlsx', 'xy.zip'):
+            target = os.path.join(self.root, 'noext')
+            shutil.copy(name, target)
+            eq_(meta.guess_format(target), os.path.splitext(name)[1][1:])
+
+        # The sniffed delimiter is used to read the file
+        m = metadata(os.path.join(self.root, 'semicolon'), tqdm_disable=True)
+        eq_(m.command[-1]['sep'], ';')
+        eq_(list(m.columns.keys()), ['a', 'b'])
+
+    def test_count_rows(self):
+        quoted = pd.DataFrame({'a': ['x\ny', 'z', '"q"\n\n'] * 50, 'b': range(150)})
+        for name, data in (('x.csv', None), ('y.csv', None), ('quoted', quoted)):
+            path = name
+            if data is not None:
+                path = os.path.join(self.root, name)
+                data.to_csv(path, index=False)
+            expected = len(pd.read_csv(path, encoding='cp1252'))
+            # Small blocks test quotes and newlines that span blocks
+            for block in (3, 7, 2 ** 20):
+                eq_(meta.count_rows(path, block=block), expected)
+        # Files need not end with a newline
+        path = os.path.join(self.root, 'nonewline.csv')
+        with io.open(path, 'wb') as handle:
+            handle.write(b'a,b\n1,2\n3,4')
+        eq_(meta.count_rows(path), 2)
+        # Empty lines are skipped, like read_csv does
+        for content in (b'\na,b\n1,2\n\n3,4\n\n', b'a,b\r\n1,2\r\n\r\n\r\n3,4\r\n\r\n',
+                        b'a,b\n"x\n\ny",2\n\n3,4'):
+            with io.open(path, 'wb') as handle:
+                handle.write(content)
+            for block in (1, 2, 3, 2 ** 20):
+                eq_(meta.count_rows(path, block=block), len(pd.read_csv(path)))
+        # UTF-16 files are counted too
+        path = os.path.join(self.root, 'quoted16.csv')
+        quoted.to_csv(path, index=False, encoding='utf-16')
+        eq_(meta.count_rows(path, {'encoding': 'utf-16'}), 150)
+        # metadata reports the number of rows even if the preview is smaller
+        m = metadata(os.path.join(self.root, 'quoted'), nrows=10, tqdm_disable=True)
+        eq_(m.rows, 150)
+        eq_(m.size, os.stat(os.path.join(self.root, 'quoted')).st_size)
+
+    def test_profile_sql(self):
+        for table in ('x', 'y'):
+            expected = meta.metadata_frame(pd.read_sql_table(table, 'sqlite:///xy.db'))
+            result = meta.profile_sql(table, 'sqlite:///xy.db', top=10)
+            eq_(result.rows, expected.rows)
+            assert_frame_equal(result['head'], expected['head'])
+            for name, col in expected.columns.items():
+                actual = result.columns[name]
+                for key in ('type_pandas', 'missing', 'nunique'):
+                    eq_(actual[key], col[key])
+                eq_(actual.top.to_dict(), col.top.to_dict())
+                if 'moments' in col:
+                    assert_series_equal(actual.moments, col.moments[actual.moments.index])
+        m = metadata('xy.db', pushdown=True, tqdm_disable=True)
+        eq_(m.datasets.y.rows, 2)
+
+    def test_catalog_sql(self):
+        path = os.path.join(self.root, 'catalog.db')
+        url = 'sqlite:///' + path
+        data = pd.DataFrame({'a': [1, 2, 3, 4] * 25, 'b': ['x', 'y', None, 'x'] * 25})
+        data.to_sql('t', url, index=False)
+        # Without statistics, the table is sampled
+        eq_(meta.catalog_sql('t', url), None)
+        m = metadata(url, catalog=True, tqdm_disable=True)
+        eq_(m.datasets.t.rows, 100)
+        ok_('estimated' not in m.datasets.t)
+        # With statistics, rows and indexed columns' nunique come from the catalog
+        engine = sa.create_engine(url)
+        with engine.connect() as conn:
+            conn.execute(sa.text('CREATE INDEX t_a ON t (a)'))
+            conn.execute(sa.text('ANALYZE'))
+        engine.dispose()
+        m = metadata(url, catalog=True, nrows=10, tqdm_disable=True)
+        result = m.datasets.t
+        self.assertDictContainsSubset({'rows': 100, 'estimated': ['rows']}, result)
+        self.assertDictContainsSubset({'nunique': 4, 'estimated': ['missing', 'nunique', 'top']},
+                                      result.columns.a)
+        # Other statistics are estimated from a random sample. Only repeated values are scaled
+        path = os.path.join(self.root, 'catalog-big.db')
+        url = 'sqlite:///' + path
+        data = pd.DataFrame({'id': range(20000), 'v': np.arange(20000) / 7,
+                             'b': ['x', 'y', None, 'x'] * 5000})
+        data.to_sql('t', url, index=False)
+        with meta.get_engine(url).connect() as conn:
+            conn.execute(sa.text('ANALYZE'))
+        m = metadata(url, catalog=True, nrows=2000, seed=0, tqdm_disable=True)
+        columns = m.datasets.t.columns
+        for name in ('id', 'v'):
+            eq_(len(columns[name].top), 0)
+            eq_(columns[name].nunique, 20000)
+        ok_(abs(columns.b.missing - 5000) < 1000)
+        eq_(columns.b.nunique, 2)
+        eq_(list(columns.b.top.index), ['x', 'y'])
+        ok_(abs(columns.b.top['x'] - 10000) < 1500)
+
+    def test_sample_sql(self):
+        path = os.path.join(self.root, 'sample.db')
+        url = 'sqlite:///' + path
+        pd.DataFrame({'a': range(1000)}).to_sql('t', url, index=False)
+        data = meta.sample_sql('t', url, nrows=100, seed=0)
+        eq_(len(data), 100)
+        eq_(data['a'].nunique(), 100)
+        # The sample spans the table, not just its first rows
+        ok_(data['a'].min() < 100 < 900 < data['a'].max())
+        # Small tables are read fully
+        eq_(len(meta.sample_sql('t', url, nrows=5000)), 1000)
+        m = metadata(url, sample=True, nrows=100, tqdm_disable=True)
+        # rows counts the table. sample_rows counts the sample
+        eq_(m.datasets.t.rows, 1000)
+        eq_(m.datasets.t.sample_rows, 100)
+        ok_('estimated' not in m.datasets.t)
+        ok_(m.datasets.t.columns.a.moments['mean'] > 100)
+        # If the table has statistics, rows is estimated from them
+        with meta.get_engine(url).connect() as conn:
+            conn.execute(sa.text('CREATE INDEX t_a ON t (a)'))
+            conn.execute(sa.text('ANALYZE'))
+        m = metadata(url, sample=True, nrows=100, tqdm_disable=True)
+        eq_(m.datasets.t.rows, 1000)
+        eq_(m.datasets.t.estimated, ['rows'])
+
+    def test_engine(self):
+        url = 'sqlite:///xy.db'
+        engine = meta.get_engine(url)
+        ok_(meta.get_engine(url) is engine)
+        ok_(meta.get_table(url, 'x') is meta.get_table(url, 'x'))
+        m = metadata('xy.db', tqdm_disable=True)
+        eq_(m.datasets.x.rows, 2)
+        assert_frame_equal(m.datasets.x.data(), pd.read_sql_table('x', engine))
+        ok_(meta.get_engine(url) is engine)
+        # Tables added later appear in the next metadata() call
+        path = os.path.join(self.root, 'grow.db')
+        pd.DataFrame({'a': [1]}).to_sql('t1', 'sqlite:///' + path, index=False)
+        eq_(list(metadata(path, tqdm_disable=True).datasets.keys()), ['t1'])
+        pd.DataFrame({'a': [1]}).to_sql('t2', 'sqlite:///' + path, index=False)
+        eq_(list(metadata(path, tqdm_disable=True).datasets.keys()), ['t1', 't2'])
+        meta.dispose_engines(url)
+        ok_(url not in meta._engines)
+        ok_(meta.get_engine(url) is not engine)
+
+    def test_parquet(self):
+        try:
+            import pyarrow      # noqa: only used by pandas
+        except ImportError:
+            raise unittest.SkipTest('pyarrow is not installed')
+        data = pd.DataFrame({'a': [3.0, None, 1.0, 7.0] * 5, 'b': list('wxyz') * 5})
+        path = os.path.join(self.root, 'data.parquet')
+        data.to_parquet(path, row_group_size=8, index=False)
+        feather = os.path.join(self.root, 'data.feather')
+        data.to_feather(feather)
+        eq_(meta.guess_format(path, ignore_ext=True), 'parquet')
+        eq_(meta.guess_format(feather, ignore_ext=True), 'feather')
+
+        m = metadata(path, nrows=4, tqdm_disable=True)
+        # The preview reads the first row group. rows, missing, min, max are from the footer
+        eq_(len(meta.preview_parquet(path)), 8)
+        eq_(m.rows, 20)
+        eq_(m.columns.a.missing, 5)
+        eq_(m.columns.a.moments['min'], 1.0)
+        eq_(m.columns.a.moments['max'], 7.0)
+        assert_frame_equal(m.data(), data)
+        assert_frame_equal(m.data(columns=['b']), data[['b']])
+        m = metadata(path, full=True, tqdm_disable=True)
+        eq_(m.rows, 20)
+        eq_(m.columns.b.nunique, 4)
+
+        m = metadata(feather, tqdm_disable=True)
+        eq_(m.rows, 20)
+        assert_frame_equal(m.data(columns=['a']), data[['a']])
+        # rows are read from the record batch headers, across batches
+        import pyarrow.feather as pf
+        pf.write_feather(data, feather, chunksize=3)
+        eq_(meta.footer_feather(feather).rows, 20)
+
+    def test_excel(self):
+        path = os.path.join(self.root, 'sheets.xlsx')
+        data = pd.DataFrame({'a': range(30), 'b': ['x', 'y', 'z'] * 10})
+        with pd.ExcelWriter(path) as writer:
+            for sheet in ('s1', 's2', 's3'):
+                data.to_excel(writer, sheet_name=sheet, index=False)
+        m = metadata(path, nrows=5, tqdm_disable=True)
+        # All sheets share one workbook, which is closed after profiling
+        eq_(meta._workbooks, {})
+        eq_(m.format, 'xlsx')
+        for sheet in ('s1', 's2', 's3'):
+            eq_(m.datasets[sheet].rows, 30)
+            eq_(len(m.datasets[sheet].data()), 30)
+        eq_(len(meta.preview_excel(path, 's2', nrows=5)), 5)
+        eq_(meta.sheet_rows(path, 's3'), 30)
+        # Full scans also read sheets from the shared workbook
+        assert_frame_equal(next(meta.scan_excel(path, 's2')), data)
+        eq_(list(meta._workbooks), [path])
+        meta.close_workbooks()
+        m = metadata(path, full=True, tqdm_disable=True)
+        eq_(meta._workbooks, {})
+        for sheet in ('s1', 's2', 's3'):
+            eq_(m.datasets[sheet].rows, 30)
+        eq_(m.datasets.s1.columns.b.nunique, 3)
+
+    def test_hdf(self):
+        path = os.path.join(self.root, 'store.h5')
+        data = pd.DataFrame({'a': range(30), 'b': [0.5, 1.5, None] * 10})
+        data.to_hdf(path, 'fixed', format='fixed')
+        data.to_hdf(path, 'tab', format='table')
+        m = metadata(path, nrows=5, tqdm_disable=True)
+        # All nodes share one store, which is closed after profiling
+        eq_(meta._stores, {})
+        for key in ('/fixed', '/tab'):
+            eq_(m.datasets[key].rows, 30)
+            eq_(len(meta.preview_hdf(path, key, nrows=5)), 5)
+            eq_(meta.hdf_rows(path, key), 30)
+        assert_frame_equal(pd.concat(meta.scan_hdf(path, '/tab', chunksize=7)), data)
+        # Rows from node attributes are plain ints, so the tree serialises
+        eq_(json.loads(m.to_json())['datasets']['/fixed']['rows'], 30)
+        ok_('!!python' not in m.to_yaml())
+        meta.close_stores()
+
+    def test_serialise(self):
+        import yaml
+        import numpy as np
+        from orderedattrdict import AttrDict
+        data = pd.DataFrame({
+            'float': [1 / 3, np.nan, np.inf, 5e-11, 1.5e-10, 1e17, -2.5e-11, 123456789.123456789],
+            'int': range(8),
+            'bool': [True, False] * 4,
+            'str': ['a', None, 'è', '/', '', 'b', np.nan, 'c'],
+            'date': pd.date_range('2000-01-01', periods=8),
+            'cat': pd.Categorical(list('xyxyxyxy')),
+            'mixed': [1, 'a', 2.5, None, [1], {'a': 1}, 'b', True],
+        }, columns=['float', 'int', 'bool', 'str', 'date', 'cat', 'mixed'])
+        tree = meta.Meta(name='x', rows=np.float64(0.1), head=data, index=data.set_index('date'),
+                         top=pd.Series([3, 2, 1], index=[1.5, 2, 'a']),
+                         columns=dict(self.result['x.csv'].columns))
+        tree.datasets = self.result
+        # Output is identical to serialising via PandasEncoder
+        old = json.dumps(tree, cls=meta.PandasEncoder, indent=4)
+        eq_(tree.to_json(), old)
+        old = json.loads(json.dumps(tree, cls=meta.PandasEncoder, indent=0),
+                         object_pairs_hook=AttrDict)
+        eq_(tree.to_yaml(), yaml.dump(old, default_flow_style=False))
+        # Output can be streamed to a file handle
+        handle = io.StringIO()
+        tree.to_json(handle)
+        eq_(handle.getvalue(), tree.to_json())
+        handle = io.StringIO()
+        tree.to_yaml(handle)
+        eq_(handle.getvalue(), tree.to_yaml())
+        # NumPy scalars, dates and timedeltas become numbers and strings
+        scalars = meta.Meta(int=np.int64(3), bool=np.bool_(True), nat=pd.NaT,
+                            date=pd.Timestamp('2019-01-02 03:04'), day=np.datetime64('2019-01-02'),
+                            delta=pd.Timedelta(hours=26))
+        expected = {'int': 3, 'bool': True, 'nat': None, 'date': '2019-01-02T03:04:00',
+                    'day': '2019-01-02T00:00:00', 'delta': '1 days 02:00:00'}
+        eq_(meta.to_primitives(scalars), expected)
+        eq_(json.loads(scalars.to_json()), expected)
+        eq_(yaml.safe_load(scalars.to_yaml()), expected)
+        with self.assertRaises(TypeError):
+            meta.to_primitives(meta.Meta(x=object()))
+
+    def test_lazy(self):
+        for source in ('xy.xlsx', 'xy.db'):
+            m = metadata(source, lazy=True, tqdm_disable=True)
+            names = list(m.datasets.keys())
+            eq_(names, list(self.result[source].datasets.keys()))
+            # Datasets are not profiled until a key they lack is accessed
+            for name in names:
+                ok_('rows' not in m.datasets[name])
+                ok_('Not profiled' in str(m.datasets[name]))
+            first = m.datasets[names[0]]
+            eq_(first.rows, self.result[source].datasets[names[0]].rows)
+            ok_('columns' in first)
+            ok_('columns' not in m.datasets[names[1]])
+            # materialize() profiles the rest, and gives the same result as metadata()
+            eq_(m.materialize(jobs=2).to_json(), self.result[source].to_json())
+
+    def test_iter_metadata(self):
+        expected = self.result['xy.xlsx']
+        items = meta.iter_metadata('xy.xlsx', tqdm_disable=True)
+        # Datasets are yielded with their path, profiled like metadata()
+        path, node = next(items)
+        name = list(expected.datasets.keys())[0]
+        eq_(path, (name, ))
+        eq_(node.rows, expected.datasets[name].rows)
+        eq_(list(node.columns.keys()), list(expected.datasets[name].columns.keys()))
+        # Stopping early closes the shared workbook
+        items.close()
+        eq_(meta._workbooks, {})
+
+        handle = io.StringIO()
+        eq_(meta.to_jsonl(meta.iter_metadata('xy.db', tqdm_disable=True), handle),
+            len(self.result['xy.db'].datasets))
+        for line, (name, node) in zip(handle.getvalue().splitlines(),
+                                      self.result['xy.db'].datasets.items()):
+            record = json.loads(line)
+            eq_(record['path'], [name])
+            eq_(record['rows'], node.rows)
+
+        # Datasets are yielded as they are found, before the rest are found
+        folder = os.path.join(self.root, 'iter')
+        os.makedirs(os.path.join(folder, 'later'))
+        shutil.copy('x.csv', os.path.join(folder, 'x.csv'))
+        items = meta.iter_metadata(folder, root=self.root, tqdm_disable=True)
+        eq_(next(items)[0], ('x.csv', ))
+        shutil.copy('y.csv', os.path.join(folder, 'later', 'y.csv'))
+        eq_([path for path, node in items], [(os.path.join('later', 'y.csv'), )])
+
+    def test_compact(self):
+        import pickle
+        data = pd.DataFrame({'a': [1, 2, 2, 3, 3, 3] * 4, 'b': list('wxxyyy') * 4})
+        m = meta.Meta(meta.metadata_frame(data, preview=4))
+        # Previews are stored pickled, and returned as DataFrames
+        ok_(isinstance(dict.__getitem__(m, 'head'), meta._CompactFrame))
+        assert_frame_equal(m.head, data.head(4))
+        assert_frame_equal(m['head'], data.head(4))
+        assert_frame_equal(m.get('head'), data.head(4))
+        # Columns use slots, but work like dicts, with top and moments as Series
+        col = m.columns.a
+        ok_(not hasattr(col, '__dict__'))
+        eq_(list(col.keys()), ['name', 'type_pandas', 'missing', 'nunique', 'top', 'moments'])
+        assert_series_equal(col.top, data.a.value_counts().head(3))
+        assert_series_equal(col['moments'], data.a.describe())
+        ok_('moments' not in m.columns.b)
+        col.estimated = ['top']
+        eq_(col.get('estimated'), ['top'])
+        del col['estimated']
+        ok_('estimated' not in col)
+        col = pickle.loads(pickle.dumps(col, protocol=pickle.HIGHEST_PROTOCOL))
+        assert_series_equal(col.top, data.a.value_counts().head(3))
+        eq_(str(m.columns), 'a (int64): 3, 2, 1\nb (object): y, x, w')
+        eq_(json.loads(m.to_json())['columns']['a']['top'], {'3': 12, '2': 8, '1': 4})
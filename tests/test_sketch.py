@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division
+
+import unittest
+import numpy as np
+import pandas as pd
+from nose.tools import eq_, ok_
+from autolysis.sketch import HyperLogLog, SpaceSaving, Moments, ColumnSketch
+from pandas.util.testing import assert_series_equal
+
+
+def chunks(series, size):
+    for start in range(0, len(series), size):
+        yield series.iloc[start:start + size]
+
+
+class TestSketch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        random = np.random.RandomState(0)
+        cls.ints = pd.Series(random.randint(0, 50000, 200000), name='ints')
+        cls.floats = pd.Series(random.randn(100000), name='floats')
+        cls.floats[::10] = np.nan
+        cls.words = pd.Series(random.choice(list('abcdefghij'), 100000,
+                                            p=[.3, .2, .1, .1, .1, .1, .04, .03, .02, .01]))
+
+    def test_hyperloglog(self):
+        # Small cardinalities are exact
+        eq_(HyperLogLog().update(self.words).count(), 10)
+        eq_(HyperLogLog().update(pd.Series([1, 2, 2, None, 1.0])).count(), 2)
+        # Large cardinalities are within 3%
+        actual = self.ints.nunique()
+        sketch = HyperLogLog().update(self.ints)
+        ok_(abs(sketch.count() / actual - 1) < 0.03)
+        # Merging sketches of chunks is the same as a sketch of the whole
+        merged = HyperLogLog()
+        for chunk in chunks(self.ints, 30000):
+            merged.merge(HyperLogLog().update(chunk))
+        eq_(merged.count(), sketch.count())
+
+    def test_space_saving(self):
+        expected = self.words.value_counts()
+        # With enough counters, counts are exact
+        assert_series_equal(SpaceSaving(capacity=20).update(self.words).result(3), expected[:3])
+        # With fewer counters, the top values are found and counts are within the error
+        sketch = SpaceSaving(capacity=5)
+        for chunk in chunks(self.words, 7000):
+            sketch.update(chunk)
+        result = sketch.result(3)
+        eq_(list(result.index), list(expected.index[:3]))
+        for key, count in result.iteritems():
+            ok_(expected[key] <= count <= expected[key] + sketch.error)
+
+    def test_moments(self):
+        sketch = Moments()
+        for chunk in chunks(self.floats, 7000):
+            sketch.update(chunk)
+        expected = self.floats.describe()[['count', 'mean', 'std', 'min', 'max']]
+        assert_series_equal(sketch.result(name='floats'), expected)
+        eq_(Moments().result()['count'], 0)
+
+    def test_column_sketch(self):
+        sketch = ColumnSketch()
+        sketch.update(pd.Series([1, 2, 3]))
+        sketch.merge(ColumnSketch().update(pd.Series([4.5, None])))
+        eq_(sketch.dtype, np.dtype(float))
+        eq_(sketch.missing, 1)
+        eq_(sketch.nunique.count(), 4)
+        eq_(sketch.moments.n, 4)
+        sketch.update(pd.Series(['x']))
+        eq_(sketch.dtype, np.dtype(object))
+
+    def test_extension_dtypes(self):
+        # Categorical, timezone-aware and nullable dtypes are sketched. Only numbers have moments
+        data = {
+            'category': pd.Series(list('abca'), dtype='category'),
+            'tz': pd.Series(pd.date_range('2019-01-01', periods=4, tz='Asia/Kolkata')),
+            'boolean': pd.Series([True, None, False, True], dtype='boolean'),
+            'Int64': pd.Series([1, None, 3, 4], dtype='Int64'),
+        }
+        for name, series in data.items():
+            sketch = ColumnSketch().update(series).merge(ColumnSketch().update(series))
+            eq_(sketch.dtype, series.dtype)
+            eq_(sketch.nunique.count(), series.nunique())
+            eq_(sketch.moments.n, 6 if name == 'Int64' else 0)
+        sketch = ColumnSketch().update(data['Int64']).update(pd.Series([0.5]))
+        eq_(sketch.dtype, np.dtype(float))
+        eq_(sketch.moments.max, 4)
+        sketch = ColumnSketch().update(data['category']).update(pd.Series([1]))
+        eq_(sketch.dtype, np.dtype(object))